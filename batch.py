@@ -0,0 +1,120 @@
+# Import Statements
+import argparse
+import json
+import players
+import sqlite3
+import sys
+import time
+import utilities
+
+
+# This function gets the tags to generate war decks for, from the arguments, a file with a tag per line, or every
+# player with saved levels
+def get_tags(args) -> list:
+    tags = list(args.tags)
+    if args.tags_file is not None:
+        with open(args.tags_file) if args.tags_file != "-" else sys.stdin as file:
+            tags.extend(line for line in file if line.strip() != "")
+    if args.all:
+        tags.extend(row[0] for row in utilities.conn.execute("SELECT DISTINCT player_tag FROM player_levels"))
+    return list(dict.fromkeys(players.normalize_tag(tag) for tag in tags))
+
+
+# This function generates the war decks of a single player from the deck index and returns their JSON line
+def generate(tag: str, index: utilities.DeckIndex, args, include_set: set, exclude_set: set) -> dict:
+    start = time.perf_counter()
+    levels = utilities.get_player_levels(tag)
+    if levels is None:
+        return {"tag": tag, "error": "Player levels not loaded"}
+
+    decks = utilities.get_candidate_decks(index, levels, exclude_set)
+    profile_path = utilities.search_profile_path(tag, args.profile)
+    best_decks = utilities.search_war_decks(args.decks_to_return, args.pruning, args.variation, include_set,
+                                            exclude_set, args.slots, decks, levels, lambda text: None,
+                                            engine=args.engine, compatibility=index.compatibility,
+                                            workers=args.workers, decks_version=index.version,
+                                            deadline=args.deadline, profile_path=profile_path, deck_index=index)
+    return {
+        "tag": tag,
+        "deck_sets": [{"score": deck_set[0],
+                       "level_utilization": utilities.level_utilization(deck_set[2], levels),
+                       "decks": deck_set[2]}
+                      for deck_set in best_decks if deck_set[0] > 0],
+        "candidate_decks": len(decks),
+        "seconds": time.perf_counter() - start
+    }
+
+
+# This function reads the card list of an option and exits if any card is unknown
+def parse_cards(card_list: str, option: str) -> set:
+    valid, cards = utilities.validate_card_list(card_list)
+    if not valid:
+        sys.exit("Unknown card in %s: %s" % (option, card_list))
+    return cards
+
+
+# Generates war decks for many players without any prompts, writing a line of JSON for each player
+# The decks are loaded and indexed once for the whole batch
+def main():
+    parser = argparse.ArgumentParser(description="Generate war decks for many players, as JSON lines")
+    parser.add_argument("tags", nargs="*", help="player tags, with or without the #")
+    parser.add_argument("--tags-file", help="a file with a player tag per line, - for standard input")
+    parser.add_argument("--all", action="store_true", help="every player with saved levels")
+    parser.add_argument("--refresh", action="store_true", help="load the levels of every player from the API first")
+    parser.add_argument("--decks-to-return", type=int, default=5, choices=range(1, 21), metavar="1-20")
+    parser.add_argument("--pruning", type=int, default=1, choices=[1, 2, 3],
+                        help="1 for iterative pruning, 2 for none, 3 for the exact search")
+    parser.add_argument("--variation", type=int, default=2, choices=[1, 2], help="1 to force variation, 2 for none")
+    parser.add_argument("--include", default="", help="space-separated cards every deck set must have")
+    parser.add_argument("--exclude", default="", help="space-separated cards no deck may have")
+    parser.add_argument("--slots", type=int, default=4, choices=[1, 2, 3, 4], help="number of decks in each set")
+    parser.add_argument("--engine", default=utilities.SEARCH_ENGINE, choices=["python", "numpy"])
+    parser.add_argument("--workers", type=int, default=utilities.SEARCH_WORKERS)
+    parser.add_argument("--deadline", type=float, help="seconds each player's search may take")
+    parser.add_argument("--profile", default=utilities.SEARCH_PROFILE_DIR, metavar="DIRECTORY",
+                        help="save a cProfile of each player's search to this directory")
+    parser.add_argument("--output", help="where to write the JSON lines, standard output by default")
+    args = parser.parse_args()
+
+    utilities.create_connection()
+    if not isinstance(utilities.conn, sqlite3.Connection):
+        sys.exit("Failed to connect to database")
+    utilities.update_schema()
+    utilities.load_cards()
+
+    include_set = parse_cards(args.include, "--include")
+    exclude_set = parse_cards(args.exclude, "--exclude")
+    tags = get_tags(args)
+    if len(tags) == 0:
+        sys.exit("No player tags given, pass tags, --tags-file or --all")
+
+    if args.refresh:
+        start = time.perf_counter()
+        loaded = players.load_players(tags)
+        print("Loaded the levels of %d of %d players in %.2fs" %
+              (sum(levels is not None for levels in loaded.values()), len(tags), time.perf_counter() - start),
+              file=sys.stderr)
+
+    start = time.perf_counter()
+    index = utilities.get_deck_index(args.engine)
+    print("Loaded %d decks in %.2fs, generating war decks for %d players..." %
+          (len(index.decks), time.perf_counter() - start, len(tags)), file=sys.stderr)
+
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        for tag in tags:
+            try:
+                result = generate(tag, index, args, include_set, exclude_set)
+            except Exception as e:
+                result = {"tag": tag, "error": str(e)}
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        utilities.conn.close()
+    print("Generated war decks for %d players in %.2fs" % (len(tags), time.perf_counter() - start), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
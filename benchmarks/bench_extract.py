@@ -0,0 +1,79 @@
+# Import Statements
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import glob
+import lxml.cssselect
+import lxml.html
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import extract
+
+# Number of pages parsed by every parser, and the worker counts the pools are run with
+NUM_PAGES = int(os.getenv("BENCH_PAGES", "2000"))
+WORKERS = [int(workers) for workers in os.getenv("BENCH_PARSE_WORKERS", "2,4").split(",")]
+
+# The saved popular decks pages the pages are taken from
+FIXTURES = sorted(glob.glob(os.path.join(BENCH_DIR, "fixtures", "popular_*.html")))
+
+
+# The old way of parsing a page: a full tree with the selectors compiled again on every call
+def legacy_parse_deck_page(text: str) -> list:
+    rows = []
+    html = lxml.html.fromstring(text)
+    entry_time = int(time.time())
+    for element in html.cssselect(".ui.two.column.stackable.padded.grid"):
+        links = list(element.iterlinks())
+        deck_id = links[0][2][13:]
+        cards = deck_id.split(",")
+        stats = element.xpath("div/div/div/div/table/tbody/tr/*/text()")
+        rating = int(stats[0].strip())
+        usage = int(stats[5].strip().replace(',', ''))
+        win_rate = float(stats[2].strip()[:-1])
+        rows.append((deck_id, cards[0], cards[1], cards[2], cards[3], cards[4], cards[5], cards[6], cards[7], rating,
+                     usage, win_rate, entry_time))
+    return rows
+
+
+# This function times a parser over every page and prints its throughput
+def run(name: str, func, pages: list):
+    start = time.perf_counter()
+    rows = func(pages)
+    elapsed = time.perf_counter() - start
+    print("%-32s %6d pages %7d decks in %6.2fs  %8.0f pages/sec" % (name, len(pages), rows, elapsed,
+                                                                     len(pages) / elapsed))
+
+
+def main():
+    texts = []
+    for path in FIXTURES:
+        with open(path, encoding="utf-8") as file:
+            texts.append(file.read())
+    if len(texts) == 0:
+        sys.exit("No fixture pages in %s" % os.path.join(BENCH_DIR, "fixtures"))
+
+    # Both parsers must give the same rows, apart from the entry time
+    for path, text in zip(FIXTURES, texts):
+        if [row[:-1] for row in extract.parse_deck_page(text)] != [row[:-1] for row in legacy_parse_deck_page(text)]:
+            sys.exit("The parsers disagree on %s" % path)
+
+    pages = [texts[i % len(texts)] for i in range(NUM_PAGES)]
+    print("%d fixture pages of %.0f KB on average" % (len(texts), sum(len(text) for text in texts) / len(texts) / 1024))
+    run("legacy, one thread", lambda pages: sum(len(legacy_parse_deck_page(text)) for text in pages), pages)
+    run("compiled, one thread", lambda pages: sum(len(extract.parse_deck_page(text)) for text in pages), pages)
+    for workers in WORKERS:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            run("compiled, %d threads" % workers,
+                lambda pages: sum(len(rows) for rows in executor.map(extract.parse_deck_page, pages)), pages)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Start the workers first, so that their start up isn't counted
+            list(executor.map(extract.parse_deck_page, texts))
+            run("compiled, %d processes" % workers,
+                lambda pages: sum(len(rows) for rows in executor.map(extract.parse_deck_page, pages, chunksize=8)),
+                pages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Import Statements
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utilities
+
+# Number of synthetic decks and players loaded, and the number of deck rows on one scraped page
+NUM_DECKS = int(os.getenv("BENCH_DECKS", "100000"))
+NUM_PLAYERS = int(os.getenv("BENCH_PLAYERS", "500"))
+PAGE_SIZE = 20
+
+
+# This function makes synthetic deck rows and player levels over a list of made up cards
+def make_data(num_decks: int, num_players: int, seed: int = 0) -> (list, list, list):
+    rnd = random.Random(seed)
+    cards = ["card-%d" % i for i in range(110)]
+    now = int(time.time())
+    rows = []
+    seen = set()
+    while len(rows) < num_decks:
+        deck = sorted(rnd.sample(cards, 8))
+        deck_id = ",".join(deck)
+        if deck_id in seen:
+            continue
+        seen.add(deck_id)
+        rows.append((deck_id, *deck, rnd.randint(1, 100), rnd.randint(10, 50000), round(rnd.uniform(40, 70), 1),
+                     now - rnd.randint(0, 200) * 3600))
+    players = [("#P%d" % i, {card: rnd.randint(9, 14) for card in cards if rnd.random() < 0.95})
+               for i in range(num_players)]
+    return cards, rows, players
+
+
+# This function opens a fresh database with the tables the loaders write to
+def open_database(path: str, cards: list, fast: bool) -> sqlite3.Connection:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    if fast:
+        utilities.DB_FILE_NAME = path
+        utilities.create_connection()
+        conn = utilities.conn
+    else:
+        conn = sqlite3.connect(path)
+    conn.execute(utilities.SQL_CREATE_DECKS_TABLE)
+    conn.execute(utilities.SQL_CREATE_DECK_CARDS_TABLE)
+    conn.execute(utilities.SQL_CREATE_LEVELS_UPDATED_TABLE)
+    conn.execute(utilities.SQL_CREATE_LEVELS_TABLE)
+    conn.execute("CREATE TABLE levels (id text PRIMARY KEY, %s)" %
+                 ", ".join("%s integer" % card.replace("-", "_") for card in cards))
+    conn.commit()
+    return conn
+
+
+# The old way of loading decks: one INSERT per row and a commit after every page
+def legacy_insert_decks(conn: sqlite3.Connection, rows: list):
+    c = conn.cursor()
+    for start in range(0, len(rows), PAGE_SIZE):
+        for row in rows[start:start + PAGE_SIZE]:
+            c.execute(utilities.SQL_INSERT_DECK, row)
+        conn.commit()
+
+
+# The old way of saving levels: an INSERT for the player and then one UPDATE per card
+# The levels table had a column per card
+def legacy_save_levels(conn: sqlite3.Connection, tag: str, levels: dict):
+    c = conn.cursor()
+    c.execute("INSERT OR REPLACE INTO levels(id) VALUES(?)", (tag,))
+    for card, level in levels.items():
+        c.execute("UPDATE levels SET %s=? WHERE id=?" % card.replace("-", "_"), (level, tag))
+    c.execute("INSERT OR REPLACE INTO levels_updated(id, updated) VALUES(?, ?)", (tag, time.time()))
+    conn.commit()
+
+
+# This function times a loader and prints its throughput
+def run(name: str, func, count: int, unit: str):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print("%-36s %8d %s in %7.2fs  %10.0f %s/sec" % (name, count, unit, elapsed, count / elapsed, unit))
+
+
+def main():
+    cards, rows, players = make_data(NUM_DECKS, NUM_PLAYERS)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+
+        conn = open_database(path, cards, False)
+        run("decks, row at a time", lambda: legacy_insert_decks(conn, rows), len(rows), "rows")
+        run("levels, statement per card", lambda: [legacy_save_levels(conn, tag, levels) for tag, levels in players],
+            len(players), "players")
+        conn.close()
+
+        open_database(path, cards, True)
+        run("decks, batched (WAL, %s)" % utilities.DB_SYNCHRONOUS, lambda: utilities.insert_decks(rows), len(rows),
+            "rows")
+        run("levels, row per card (WAL, %s)" % utilities.DB_SYNCHRONOUS,
+            lambda: [utilities.save_levels(tag, levels) for tag, levels in players], len(players), "players")
+        utilities.conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# Import Statements
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import players
+import utilities
+
+# Number of synthetic players, the latency of the mock player API in seconds, and the share of its responses that are
+# a 429 or a 503, which the loaders have to retry
+NUM_PLAYERS = int(os.getenv("BENCH_PLAYERS", "200"))
+LATENCY = float(os.getenv("BENCH_LATENCY", "0.05"))
+FAILURE_RATE = float(os.getenv("BENCH_FAILURE_RATE", "0.1"))
+
+# Number of players fetched at once by the bulk loader
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "8"))
+
+# The max level of every card rarity in the player API
+MAX_LEVELS = {"common": 14, "rare": 12, "epic": 9, "legendary": 6, "champion": 4}
+
+
+# This function makes synthetic cards, with names that need more than a lower case conversion to become ids
+def make_cards() -> list:
+    rarities = list(MAX_LEVELS)
+    cards = []
+    for i in range(110):
+        name = "Card %d" % i if i % 10 != 0 else "Card P.E.K.K.A %d" % i
+        cards.append((name.lower().replace(" ", "-").replace(".", ""), name, 1 + i % 9, "troop", rarities[i % 5]))
+    return cards
+
+
+# This function makes the levels of the synthetic players, as a dictionary from tag to levels
+def make_players(cards: list, rnd: random.Random) -> dict:
+    return {"#MOCK%d" % i: {card[0]: rnd.randint(max(1, 15 - MAX_LEVELS[card[4]]), 14) for card in cards
+                            if rnd.random() < 0.95}
+            for i in range(NUM_PLAYERS)}
+
+
+# This function starts a mock player API on a free local port and returns the server
+# Unknown players get a 404, and a FAILURE_RATE share of the requests get a 429 or a 503 instead of an answer
+def start_mock_api(cards: list, expected: dict) -> ThreadingHTTPServer:
+    by_id = {card[0]: card for card in cards}
+    rnd = random.Random(1)
+    lock = threading.Lock()
+    stats = {"requests": 0, "failures": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            time.sleep(LATENCY)
+            with lock:
+                stats["requests"] += 1
+                failure = rnd.random() < FAILURE_RATE
+                stats["failures"] += failure
+            if failure:
+                if rnd.random() < 0.5:
+                    self.send(429, {"reason": "requestThrottled"}, {"Retry-After": "0"})
+                else:
+                    self.send(503, {"reason": "serviceUnavailable"})
+                return
+            tag = unquote(self.path.rsplit("/", 1)[-1])
+            levels = expected.get(tag)
+            if levels is None:
+                self.send(404, {"reason": "notFound"})
+                return
+            self.send(200, {"tag": tag, "name": "Player %s" % tag, "cards": [
+                {"name": by_id[card][1], "level": level - 14 + MAX_LEVELS[by_id[card][4]],
+                 "maxLevel": MAX_LEVELS[by_id[card][4]]} for card, level in levels.items()]})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# This function checks that every player's saved levels are the expected ones
+def check_saved(expected: dict):
+    for tag, levels in expected.items():
+        if utilities.get_player_levels(tag) != levels:
+            sys.exit("Wrong levels saved for %s" % tag)
+
+
+# This function times a loader and prints its throughput
+def run(name: str, func, count: int):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print("%-28s %6d players in %7.2fs  %8.1f players/sec" % (name, count, elapsed, count / elapsed))
+
+
+def main():
+    rnd = random.Random(0)
+    cards = make_cards()
+    expected = make_players(cards, rnd)
+    server = start_mock_api(cards, expected)
+    utilities.PLAYER_API_URL = "http://127.0.0.1:%d/v1" % server.server_port
+    utilities.HTTP_BACKOFF = 0.01
+    tags = list(expected) + ["#MISSING"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        utilities.DB_FILE_NAME = os.path.join(directory, "bench.db")
+        utilities.create_connection()
+        for sql in (utilities.SQL_CREATE_CARDS_TABLE, utilities.SQL_CREATE_LEVELS_TABLE,
+                    utilities.SQL_CREATE_LEVELS_UPDATED_TABLE):
+            utilities.create_table(sql)
+        utilities.conn.executemany("INSERT INTO cards(id, name, elixir, type, rarity) VALUES(?, ?, ?, ?, ?)", cards)
+        utilities.conn.commit()
+
+        print("Mock player API with %.0f ms of latency and %d%% of requests failing" %
+              (LATENCY * 1000, FAILURE_RATE * 100))
+        run("one at a time", lambda: [utilities.load_levels(tag) for tag in tags], len(tags))
+        check_saved(expected)
+        utilities.conn.execute("DELETE FROM player_levels")
+        utilities.conn.commit()
+
+        loaded = {}
+        run("bulk, %d at a time" % CONCURRENCY,
+            lambda: loaded.update(players.load_players(tags, CONCURRENCY, rate=1000)), len(tags))
+        check_saved(expected)
+        if loaded["#MISSING"] is not None or sum(levels is None for levels in loaded.values()) != 1:
+            sys.exit("Only the missing player should have failed to load")
+        print("%d requests, %d of them failed and were retried" %
+              (server.stats["requests"], server.stats["failures"]))
+        utilities.conn.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Import Statements
+import asyncio
+import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import extract
+import http_cache
+import scraper
+import utilities
+
+# The latency of the stand-in RoyaleAPI server in seconds, and how often the event loop checks how late it is
+LATENCY = float(os.getenv("BENCH_LATENCY", "0.05"))
+TICK = float(os.getenv("BENCH_TICK", "0.01"))
+
+# The saved popular decks pages the stand-in server answers with
+FIXTURES = sorted(glob.glob(os.path.join(BENCH_DIR, "fixtures", "popular_*.html")))
+
+
+# This function starts a stand-in for RoyaleAPI on a free local port and returns the server
+# The popular decks page of a card is its saved page if there is one, or else one of the other saved pages
+def start_site(pages: dict) -> ThreadingHTTPServer:
+    names = sorted(pages)
+    stats = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(LATENCY)
+            with lock:
+                stats["requests"] += 1
+            card = parse_qs(urlparse(self.path).query).get("inc", ["all"])[0]
+            name = card if card in pages else names[sum(map(ord, card)) % len(names)]
+            body = pages[name]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# This function runs a deck update inside an event loop that also checks how late it wakes up every TICK seconds,
+# which is how long the bot can't answer anyone. Returns the time the update took and the longest delay
+def run_on_loop(update) -> (float, float):
+    async def measure() -> (float, float):
+        done = asyncio.Event()
+        worst = 0.0
+
+        async def heartbeat():
+            nonlocal worst
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(TICK)
+                worst = max(worst, time.perf_counter() - start - TICK)
+
+        task = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await update()
+        elapsed = time.perf_counter() - start
+        done.set()
+        await task
+        return elapsed, worst
+
+    return asyncio.run(measure())
+
+
+# This function empties the decks and the HTTP cache, so that every update starts from scratch
+def reset():
+    shutil.rmtree(http_cache.HTTP_CACHE_DIR, ignore_errors=True)
+    for table in ("decks", "deck_cards", "deck_compatibility"):
+        utilities.conn.execute("DELETE FROM %s" % table)
+    utilities.conn.commit()
+
+
+def main():
+    pages = {os.path.basename(path)[8:-5]: open(path, "rb").read() for path in FIXTURES}
+    cards = sorted({card for page in pages.values() for row in extract.parse_deck_page(page.decode())
+                    for card in row[1:9]})
+    server = start_site(pages)
+    utilities.ROYALEAPI_URL = "http://127.0.0.1:%d" % server.server_port
+
+    with tempfile.TemporaryDirectory() as directory:
+        utilities.DB_FILE_NAME = os.path.join(directory, "bench.db")
+        utilities.DECK_SNAPSHOT_PATH = os.path.join(directory, "decks.snapshot")
+        http_cache.HTTP_CACHE_DIR = os.path.join(directory, ".http_cache")
+        utilities.create_connection()
+        utilities.update_schema()
+        utilities.conn.executemany("INSERT INTO cards(id, name, elixir, type, rarity) VALUES(?, ?, 1, 'troop', "
+                                   "'common')", [(card, card) for card in cards])
+        utilities.conn.commit()
+        print("Stand-in RoyaleAPI with %.0f ms of latency, %d pages of %d saved pages" %
+              (LATENCY * 1000, len(cards), len(pages)))
+
+        # The old way, scraping on the event loop with the shared connection
+        async def blocking():
+            scraper.scrape_all_cards()
+            utilities.purge_old_decks(60)
+
+        # The bot's way, scraping on another thread with its own connection
+        async def threaded():
+            await asyncio.to_thread(scraper.update_all_decks, 60)
+
+        for name, update in (("on the event loop", blocking), ("on another thread", threaded)):
+            reset()
+            elapsed, worst = run_on_loop(update)
+            decks = utilities.conn.execute("SELECT COUNT(*) FROM decks").fetchone()[0]
+            print("%-20s %5d decks in %6.2fs  event loop blocked for up to %7.1f ms" %
+                  (name, decks, elapsed, worst * 1000))
+        print("%d requests" % server.stats["requests"])
+        utilities.conn.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# Import Statements
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import utilities
+
+# Number of synthetic cards, and the share of cards each synthetic player has
+NUM_CARDS = 110
+CARD_OWNERSHIP = 0.95
+
+# Synthetic databases older than this many seconds are made again, since deck scores decay with the age of the decks
+DATA_MAX_AGE = 12 * 60 * 60
+
+# A cell is slower than its baseline if its median latency grew by more than this share, and worse if its quality
+# dropped by more than this much
+LATENCY_TOLERANCE = 0.2
+QUALITY_TOLERANCE = 0.001
+
+
+# This function makes a synthetic card list, where card i is picked for decks with a weight of 1 / (i + 1) ** skew
+def make_cards() -> list:
+    rarities = ["common", "rare", "epic", "legendary"]
+    types = ["troop", "spell", "building"]
+    return [("card-%d" % i, "Card %d" % i, 1 + i % 9, types[i % 3], rarities[i % 4]) for i in range(NUM_CARDS)]
+
+
+# This function makes synthetic deck rows with skewed card popularity
+# Popular decks are used more and have a higher rating, and decks were all seen in the last three days
+def make_decks(cards: list, num_decks: int, skew: float, rnd: random.Random) -> list:
+    ids = [card[0] for card in cards]
+    weights = [1 / (i + 1) ** skew for i in range(len(ids))]
+    now = int(time.time())
+    rows = []
+    seen = set()
+    while len(rows) < num_decks:
+        deck = set()
+        while len(deck) < 8:
+            deck.update(rnd.choices(ids, weights, k=8 - len(deck)))
+        deck = sorted(deck)
+        deck_id = ",".join(deck)
+        if deck_id in seen:
+            continue
+        seen.add(deck_id)
+        usage = int(rnd.paretovariate(1.2) * 50)
+        rows.append((deck_id, *deck, min(100, usage // 10), usage, round(rnd.gauss(52, 5), 1),
+                     now - rnd.randint(0, 3 * 24 * 60) * 60))
+    return rows
+
+
+# This function makes the levels of the synthetic players
+def make_players(cards: list, num_players: int, rnd: random.Random) -> list:
+    return [("#BENCH%d" % i, {card[0]: rnd.choice([9, 10, 11, 11, 12, 12, 13, 13, 14])
+                              for card in cards if rnd.random() < CARD_OWNERSHIP})
+            for i in range(num_players)]
+
+
+# This function gets the path of the synthetic database for a size, building it first if it doesn't exist yet
+def build_database(data_dir: str, num_decks: int, skew: float, num_players: int, seed: int) -> str:
+    path = os.path.join(data_dir, "bench_%d_%g_%d_%d.db" % (num_decks, skew, num_players, seed))
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < DATA_MAX_AGE:
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    for suffix in ("", "-wal", "-shm", ".snapshot"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    print("Building a synthetic database with %d decks..." % num_decks)
+    rnd = random.Random(seed)
+    cards = make_cards()
+    utilities.DB_FILE_NAME = path
+    utilities.create_connection()
+    for sql in (utilities.SQL_CREATE_CARDS_TABLE, utilities.SQL_CREATE_METADATA_TABLE,
+                utilities.SQL_CREATE_DECK_COMPATIBILITY_TABLE, utilities.SQL_CREATE_LEVELS_TABLE,
+                utilities.SQL_CREATE_LEVELS_UPDATED_TABLE):
+        utilities.create_table(sql)
+    utilities.update_decks_table()
+    utilities.update_deck_cards_table()
+    utilities.conn.executemany("INSERT INTO cards(id, name, elixir, type, rarity) VALUES(?, ?, ?, ?, ?)", cards)
+    utilities.conn.commit()
+    rows = make_decks(cards, num_decks, skew, rnd)
+    for start in range(0, len(rows), 50000):
+        utilities.insert_decks(rows[start:start + 50000])
+    utilities.bump_decks_version()
+    utilities.update_compatibility_index()
+    for tag, levels in make_players(cards, num_players, rnd):
+        utilities.save_levels(tag, levels)
+    utilities.conn.close()
+    utilities.conn = None
+    return path
+
+
+# This function gets the p-th percentile of a list of values with the nearest-rank method
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+
+# This function runs one cell of the matrix for every player in a fresh process, so that its peak RSS is its own
+# Every search runs like it does for the command line and the bot, from the deck index with its compatibility index,
+# and isn't stopped at the budget, which is only checked against the time it took
+# Returns the latencies, the scores of the returned sets, whether any search ran over its budget, and the RSS
+def run_cell(path: str, cell: dict, repeats: int, budget: float) -> dict:
+    utilities.DB_FILE_NAME = path
+    utilities.DECK_SNAPSHOT_PATH = path + ".snapshot"
+    utilities.create_connection()
+    tags = [row[0] for row in utilities.conn.execute("SELECT id FROM levels_updated ORDER BY id")]
+    start = time.perf_counter()
+    deck_index = utilities.get_deck_index(cell["engine"])
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    players = [(tag, utilities.get_player_levels(tag)) for tag in tags]
+    players = [(tag, levels, utilities.get_candidate_decks(deck_index, levels, set()))
+               for tag, levels in players]
+    load_time = (time.perf_counter() - start) / len(players)
+    rss_loaded = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies = []
+    scores = {}
+    timed_out = False
+    for tag, levels, decks in players:
+        for _ in range(repeats):
+            # Every run is a result cache miss, so that the search itself is measured
+            utilities.result_cache.clear()
+            start = time.perf_counter()
+            best_decks = utilities.search_war_decks(5, cell["pruning"], cell["variation"], set(), set(), cell["slots"],
+                                                    decks, levels, lambda text: None, engine=cell["engine"],
+                                                    compatibility=deck_index.compatibility,
+                                                    decks_version=deck_index.version, deck_index=deck_index)
+            latencies.append(time.perf_counter() - start)
+            timed_out = timed_out or latencies[-1] >= budget
+            scores[tag] = [round(deck[0], 6) for deck in best_decks]
+    utilities.conn.close()
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"latencies": latencies, "scores": scores, "timed_out": timed_out, "index_s": index_time,
+            "load_s": load_time, "rss_loaded_mb": rss_loaded / 1024, "rss_peak_mb": rss_peak / 1024}
+
+
+# This function gets the current commit of the repository, if there is one
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# This function runs the whole matrix and returns the report
+# Once a cell goes over its budget at one size, it is skipped at the larger sizes
+def run_matrix(args) -> dict:
+    cells = [{"engine": engine, "pruning": pruning, "variation": variation, "slots": slots}
+             for engine in args.engines for pruning in args.pruning for variation in args.variation
+             for slots in args.slots]
+    results = []
+    too_slow = set()
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        path = build_database(args.data_dir, size, args.skew, args.players, args.seed)
+        size_results = []
+        for cell in cells:
+            name = "%s/p%d/v%d/s%d" % (cell["engine"], cell["pruning"], cell["variation"], cell["slots"])
+            if name in too_slow:
+                size_results.append({"decks": size, "cell": name, **cell, "skipped": True})
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_cell, path, cell, args.repeats, args.budget).result()
+            if result["timed_out"]:
+                too_slow.add(name)
+            size_results.append({"decks": size, "cell": name, **cell, "skipped": False, **result})
+            print("%8d %-18s p50 %8.3fs  p99 %8.3fs  peak %7.1f MB%s" %
+                  (size, name, percentile(result["latencies"], 50), percentile(result["latencies"], 99),
+                   result["rss_peak_mb"], "  (over budget)" if result["timed_out"] else ""))
+
+        # The reference for each player and slot count is the best set found by any cell, usually the exact search
+        for result in size_results:
+            if result["skipped"]:
+                continue
+            quality = []
+            for tag, scores in result["scores"].items():
+                reference = max((other["scores"][tag][0] for other in size_results if not other["skipped"] and
+                                 other["slots"] == result["slots"] and len(other["scores"][tag]) > 0), default=None)
+                if reference:
+                    quality.append(scores[0] / reference if len(scores) > 0 else 0.0)
+            latencies = result.pop("latencies")
+            result.update({"p50_s": percentile(latencies, 50), "p90_s": percentile(latencies, 90),
+                           "p99_s": percentile(latencies, 99), "max_s": max(latencies), "runs": len(latencies),
+                           "quality": sum(quality) / len(quality) if quality else None})
+        results.extend(size_results)
+
+    return {"commit": get_commit(), "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "params": {"skew": args.skew, "players": args.players, "repeats": args.repeats, "budget": args.budget,
+                       "seed": args.seed}, "results": results}
+
+
+# This function compares a report to a baseline report, printing every cell and returning the number of regressions
+def compare(report: dict, baseline: dict) -> int:
+    old = {(result["decks"], result["cell"]): result for result in baseline["results"] if not result["skipped"]}
+    regressions = 0
+    print("\nCompared to %s (%s):" % (baseline.get("commit"), baseline.get("created")))
+    for result in report["results"]:
+        before = old.get((result["decks"], result["cell"]))
+        if result["skipped"] or before is None:
+            continue
+        change = result["p50_s"] / before["p50_s"] - 1 if before["p50_s"] > 0 else 0.0
+        slower = change > LATENCY_TOLERANCE
+        worse = (result["quality"] is not None and before["quality"] is not None and
+                 result["quality"] < before["quality"] - QUALITY_TOLERANCE)
+        regressions += slower or worse
+        print("%8d %-18s p50 %8.3fs -> %8.3fs (%+6.1f%%)  quality %s -> %s%s" %
+              (result["decks"], result["cell"], before["p50_s"], result["p50_s"], change * 100, before["quality"],
+               result["quality"], "  REGRESSION" if slower or worse else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark war deck generation on synthetic databases")
+    parser.add_argument("--sizes", default="1000,10000", help="deck counts, such as 1000,10000,100000,1000000")
+    parser.add_argument("--skew", type=float, default=0.8, help="card popularity skew, 0 for uniform")
+    parser.add_argument("--players", type=int, default=3, help="number of synthetic players")
+    parser.add_argument("--repeats", type=int, default=3, help="runs of every cell for each player")
+    parser.add_argument("--budget", type=float, default=60, help="seconds a single search may take")
+    parser.add_argument("--pruning", default="1,2,3", help="pruning modes to run")
+    parser.add_argument("--variation", default="1,2", help="variation modes to run")
+    parser.add_argument("--slots", default="1,2,3,4", help="deck slot counts to run")
+    parser.add_argument("--engines", default="python", help="search engines to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(BENCH_DIR, "data"))
+    parser.add_argument("--output", help="where to save the report, benchmarks/results/<time>.json by default")
+    parser.add_argument("--baseline", help="a saved report to compare against, exits with 1 on a regression")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.pruning = [int(pruning) for pruning in args.pruning.split(",")]
+    args.variation = [int(variation) for variation in args.variation.split(",")]
+    args.slots = [int(slots) for slots in args.slots.split(",")]
+    args.engines = args.engines.split(",")
+
+    report = run_matrix(args)
+    output = args.output or os.path.join(BENCH_DIR, "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print("Saved the report to %s" % output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            if compare(report, json.load(file)) > 0:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
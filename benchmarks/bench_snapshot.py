@@ -0,0 +1,97 @@
+# Import Statements
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+from bench_ingest import make_data
+import utilities
+
+# Number of synthetic decks, and the number of players candidate decks are selected for
+NUM_DECKS = int(os.getenv("BENCH_DECKS", "100000"))
+NUM_PLAYERS = int(os.getenv("BENCH_PLAYERS", "20"))
+
+# The engines the deck index is loaded for
+ENGINES = os.getenv("BENCH_ENGINES", "python,numpy").split(",")
+
+
+# This function loads the deck index and prints how long it took and how much memory it holds
+def run(name: str, engine: str) -> utilities.DeckIndex:
+    utilities.deck_index_cache = None
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = utilities.load_deck_index(engine)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-30s %7d decks in %6.3fs  %8.1f MB held" % (name, len(index.decks), elapsed, memory / 1024 / 1024))
+    return index
+
+
+# This function times selecting the candidate decks of every player from a deck index
+# The first time a deck index is used, the decks with each card are read from deck_cards as the players need them
+def run_candidates(name: str, index: utilities.DeckIndex, players: list) -> list:
+    start = time.perf_counter()
+    candidates = [utilities.get_candidate_decks(index, levels, set()) for _, levels in players]
+    elapsed = time.perf_counter() - start
+    print("%-30s %7d players in %6.3fs  %8.1f ms/player" % (name, len(players), elapsed,
+                                                               elapsed / len(players) * 1000))
+    return candidates
+
+
+# This function times scoring the candidate decks of every player, which is the first step of every search
+def run_scores(name: str, index: utilities.DeckIndex, players: list, candidates: list) -> list:
+    start = time.perf_counter()
+    tables = [utilities.build_deck_table(decks, levels, set(), dict(index.card_index), index.compatibility,
+                                         index.masks) for (_, levels), decks in zip(players, candidates)]
+    elapsed = time.perf_counter() - start
+    print("%-30s %7d players in %6.3fs  %8.1f ms/player" % (name, len(players), elapsed,
+                                                               elapsed / len(players) * 1000))
+    return tables
+
+
+def main():
+    cards, rows, players = make_data(NUM_DECKS, NUM_PLAYERS)
+    with tempfile.TemporaryDirectory() as directory:
+        utilities.DB_FILE_NAME = os.path.join(directory, "bench.db")
+        utilities.DECK_SNAPSHOT_PATH = os.path.join(directory, "decks.snapshot")
+        utilities.create_connection()
+        for sql in (utilities.SQL_CREATE_CARDS_TABLE, utilities.SQL_CREATE_DECKS_TABLE,
+                    utilities.SQL_CREATE_DECK_CARDS_TABLE, utilities.SQL_CREATE_DECK_CARDS_INDEX,
+                    utilities.SQL_CREATE_METADATA_TABLE, utilities.SQL_CREATE_DECK_COMPATIBILITY_TABLE):
+            utilities.create_table(sql)
+        utilities.write_decks(rows)
+
+        start = time.perf_counter()
+        utilities.save_deck_snapshot()
+        print("Wrote a %.1f MB snapshot of %d decks in %.3fs" % (os.path.getsize(utilities.DECK_SNAPSHOT_PATH) /
+                                                                 1024 / 1024, len(rows), time.perf_counter() - start))
+
+        for engine in ENGINES:
+            if engine == "numpy" and utilities.get_vectorized() is None:
+                continue
+            path = utilities.DECK_SNAPSHOT_PATH
+            utilities.DECK_SNAPSHOT_PATH = ""
+            table_index = run("%s, decks table" % engine, engine)
+            utilities.DECK_SNAPSHOT_PATH = path
+            snapshot_index = run("%s, snapshot" % engine, engine)
+            if engine == "python":
+                expected = run_candidates("candidates, decks table", table_index, players)
+                found = run_candidates("candidates, snapshot", snapshot_index, players)
+                run_candidates("candidates again, snapshot", snapshot_index, players)
+                if [[deck[:13] for deck in decks] for decks in found] != \
+                        [[deck[:13] for deck in decks] for decks in expected]:
+                    sys.exit("The snapshot gives different candidate decks")
+                expected = run_scores("scores, decks table", table_index, players, expected)
+                found = run_scores("scores, snapshot", snapshot_index, players, found)
+                if [(table.ids, list(table.scores)) for table in found] != \
+                        [(table.ids, list(table.scores)) for table in expected]:
+                    sys.exit("The snapshot gives different deck scores")
+        utilities.conn.close()
+
+
+if __name__ == "__main__":
+    main()
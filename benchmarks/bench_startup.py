@@ -0,0 +1,99 @@
+# Import Statements
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, REPO_DIR)
+from bench_ingest import make_data
+import utilities
+
+# Number of synthetic decks in the database, and the number of times every start up is timed
+NUM_DECKS = int(os.getenv("BENCH_DECKS", "20000"))
+RUNS = int(os.getenv("BENCH_RUNS", "5"))
+
+# The modules that are imported, and the slow imports none of them should load
+MODULES = ["utilities", "scraper", "main", "batch"]
+HEAVY_MODULES = ["discord", "lxml", "numpy", "requests", "alive_progress"]
+
+
+# This function gets a URL on a local port that nothing listens on, so that every request fails right away as if
+# there were no network
+def offline_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:%d/cards.json" % sock.getsockname()[1]
+
+
+# This function runs a command RUNS times and returns the median time it took, exiting if it fails
+def time_command(args: list, cwd: str, env: dict, stdin: str = "") -> float:
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = subprocess.run(args, cwd=cwd, env=env, input=stdin, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            sys.exit("%s failed:\n%s" % (" ".join(args), result.stderr))
+    return statistics.median(times)
+
+
+# This function prints how long importing every module takes in a fresh interpreter, and which slow imports it loads
+def bench_imports(env: dict):
+    code = "import sys, time; start = time.perf_counter(); import %s; print(time.perf_counter() - start); " \
+           "print(' '.join(name for name in %r if name in sys.modules))"
+    for module in MODULES:
+        times = []
+        for _ in range(RUNS):
+            output = subprocess.run([sys.executable, "-c", code % (module, HEAVY_MODULES)], cwd=REPO_DIR, env=env,
+                                    capture_output=True, text=True, check=True).stdout.split("\n")
+            times.append(float(output[0]))
+        print("%-34s %7.3fs  slow imports: %s" % ("import " + module, statistics.median(times), output[1] or "none"))
+
+
+# This function makes a database with the cards and decks a start up works from
+def make_database(directory: str, cards: list, rows: list):
+    utilities.DB_FILE_NAME = os.path.join(directory, "database.db")
+    utilities.DECK_SNAPSHOT_PATH = os.path.join(directory, "decks.snapshot")
+    utilities.create_connection()
+    utilities.update_schema()
+    utilities.conn.executemany("INSERT INTO cards(id, name, elixir, type, rarity) VALUES(?, ?, ?, 'troop', 'common')",
+                               [(card, card, 1 + i % 9) for i, card in enumerate(cards)])
+    utilities.conn.execute(utilities.SQL_SET_CARDS_UPDATED, (int(time.time()),))
+    utilities.conn.commit()
+    utilities.write_decks(rows)
+
+
+def main():
+    env = dict(os.environ, CARDS_URL=offline_url(), HTTP_RETRIES="4", HTTP_BACKOFF="0.5")
+    bench_imports(env)
+
+    cards, rows, _ = make_data(NUM_DECKS, 0)
+    with tempfile.TemporaryDirectory() as directory:
+        make_database(directory, cards, rows)
+        env["HTTP_CACHE_DIR"] = os.path.join(directory, ".http_cache")
+        main_args = [sys.executable, os.path.join(REPO_DIR, "main.py")]
+
+        # Every start up goes from launching main.py to exiting from its menu, without a network
+        seconds = time_command(main_args, directory, env, "4\n")
+        print("%-34s %7.3fs" % ("start up, card list up to date", seconds))
+
+        utilities.conn.execute("DELETE FROM metadata WHERE key='cards_updated'")
+        utilities.conn.commit()
+        seconds = time_command(main_args, directory, env, "4\n")
+        print("%-34s %7.3fs" % ("start up, card list stale", seconds))
+
+        utilities.conn.execute("DELETE FROM metadata WHERE key='schema_version'")
+        utilities.conn.commit()
+        start = time.perf_counter()
+        subprocess.run(main_args, cwd=directory, env=env, input="4\n", capture_output=True, text=True, check=True)
+        print("%-34s %7.3fs" % ("start up, schema out of date", time.perf_counter() - start))
+        utilities.conn.close()
+
+
+if __name__ == "__main__":
+    main()
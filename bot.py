@@ -1,27 +1,45 @@
 # Import Statements
-from alive_progress import alive_bar
+# lxml and alive_progress are slow to import, so they are only imported by the functions that update decks and load
+# deck info
+import asyncio
+from collections import OrderedDict
 from datetime import datetime
 import discord
 from discord import option
 from discord.ext import pages, tasks
-import lxml.html
-import lxml.cssselect
+import http_cache
+import metrics
 import os
-import requests
+import scraper
+from scheduler import JobCancelledError, JobScheduler, QueueFullError, UserLimitError
 import statistics
 import sys
+import time
 import utilities
 
 # Initializing the bot
 bot = discord.Bot()
 
-# Create a table if it does not already exist
-def create_table(table_creation_sql: str):
-    if utilities.conn is not None:
-        c = utilities.conn.cursor()
-        c.execute(table_creation_sql)
-        utilities.conn.commit()
+# Initializing the scheduler that runs war deck generation off the event loop
+scheduler = JobScheduler(workers=int(os.getenv("JOB_WORKERS", "2")),
+                         queue_size=int(os.getenv("JOB_QUEUE_SIZE", "20")),
+                         user_limit=int(os.getenv("JOB_USER_LIMIT", "1")),
+                         timeout=float(os.getenv("JOB_TIMEOUT", "120")))
 
+# How long war deck generation runs for in seconds before the best deck sets found so far are returned
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "100"))
+
+# How long player levels are cached for in seconds, the most players cached at once, and whether levels are also
+# saved to the levels table
+LEVELS_CACHE_TTL = float(os.getenv("LEVELS_CACHE_TTL", "300"))
+LEVELS_CACHE_SIZE = int(os.getenv("LEVELS_CACHE_SIZE", "1024"))
+LEVELS_CACHE_PERSIST = os.getenv("LEVELS_CACHE_PERSIST", "0") == "1"
+
+# Player levels cache, from player tag to (time fetched, levels dictionary), with the most recently fetched entry last
+levels_cache = OrderedDict()
+
+# Fetches of player levels that are in progress, from player tag to task
+levels_fetches = {}
 
 def load_levels(tag: str):
     if len(tag) == 0:
@@ -31,8 +49,8 @@ def load_levels(tag: str):
         tag = tag[1:]
     tag = tag.upper()
 
-    url = "https://proxy.royaleapi.dev/v1/players/%23" + tag
-    player_info = requests.get(url, headers={"Authorization": "Bearer " + utilities.CR_API_TOKEN}).json()
+    player_info = utilities.get_session().get(utilities.player_url(tag), headers=utilities.player_api_headers(),
+                                              timeout=utilities.HTTP_TIMEOUT).json()
 
     if "reason" in player_info:
         return None
@@ -40,12 +58,77 @@ def load_levels(tag: str):
     return player_info["cards"]
 
 
+# This function fetches a player's levels and converts them into a dictionary from card id to level
+async def fetch_levels(tag: str) -> dict | None:
+    start = time.perf_counter()
+    player_info = await asyncio.to_thread(load_levels, tag)
+    metrics.observe("load_levels_seconds", time.perf_counter() - start, stage="fetch")
+    if player_info is None:
+        return None
+
+    # Convert the object array into a dictionary for faster processing
+    levels = utilities.player_levels_from_cards(player_info, utilities.get_card_names())
+
+    cache_levels(tag, levels)
+    if LEVELS_CACHE_PERSIST:
+        utilities.save_levels(tag, levels)
+    return levels
+
+
+# This function stores a player's levels in the levels cache
+# Entries are kept in the order they were fetched, so the expired ones are all at the front and are dropped here,
+# along with the oldest ones if the cache is still over LEVELS_CACHE_SIZE
+def cache_levels(tag: str, levels: dict):
+    now = time.monotonic()
+    levels_cache[tag] = (now, levels)
+    levels_cache.move_to_end(tag)
+    while len(levels_cache) > 0:
+        fetched = next(iter(levels_cache.values()))[0]
+        if now - fetched < LEVELS_CACHE_TTL and len(levels_cache) <= LEVELS_CACHE_SIZE:
+            break
+        levels_cache.popitem(last=False)
+
+
+# This function gets a player's levels, from the cache if they were fetched within the last LEVELS_CACHE_TTL seconds
+# Concurrent requests for the same player share a single fetch
+async def get_levels(tag: str) -> dict | None:
+    entry = levels_cache.get(tag)
+    if entry is not None and time.monotonic() - entry[0] < LEVELS_CACHE_TTL:
+        metrics.inc("levels_cache_total", result="hit")
+        return entry[1]
+
+    if LEVELS_CACHE_PERSIST:
+        levels = utilities.get_saved_levels(tag, LEVELS_CACHE_TTL)
+        if levels is not None:
+            cache_levels(tag, levels)
+            metrics.inc("levels_cache_total", result="saved")
+            return levels
+    metrics.inc("levels_cache_total", result="miss")
+
+    task = levels_fetches.get(tag)
+    if task is None:
+        task = asyncio.create_task(fetch_levels(tag))
+        levels_fetches[tag] = task
+        task.add_done_callback(lambda _: levels_fetches.pop(tag, None))
+    return await asyncio.shield(task)
+
+
+# This function describes the best deck set found so far for the progress message
+def describe_best_so_far(best_decks: list) -> str:
+    if len(best_decks) == 0:
+        return "Still searching for deck sets..."
+    text = "Best deck set so far with a score of %.2f, still looking for better ones...\n" % best_decks[0][0]
+    for deck in best_decks[0][2]:
+        text += "https://royaleapi.com/decks/stats/%s\n" % deck
+    return text
+
+
 @bot.slash_command(name="generate_war_decks", description="Generate optimal war decks for a player")
 @option("tag", description="Your player tag")
 @option("decks_to_return", description="The number of decks to return (between 1 and 10)",
         choices=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
-@option("pruning", description="Whether to prune the search tree, select 1 for yes and 2 for no",
-        choices=["Yes", "No"])
+@option("pruning", description="Whether to prune the search tree, or to run an exact search instead",
+        choices=["Yes", "No", "Exact"])
 @option("variation", description="Whether to force variation in the decks, select 1 for yes and 2 for no",
         choices=["Yes", "No"])
 @option("include_cards", description="The cards to include in the war decks")
@@ -62,8 +145,8 @@ async def generate_war_decks(ctx: discord.ApplicationContext, tag: str, decks_to
         tag = tag.upper()
 
         # Load the player tag and return an error if something goes wrong
-        player_info = load_levels(tag)
-        if player_info is None:
+        levels = await get_levels(tag)
+        if levels is None:
             await ctx.respond("Error loading player levels...", ephemeral=True)
             return
 
@@ -76,28 +159,44 @@ async def generate_war_decks(ctx: discord.ApplicationContext, tag: str, decks_to
         include_set = include_set[1]
         exclude_set = exclude_set[1]
 
-        # Convert the object array into a dictionary for faster processing
-        levels = {}
-        for card in player_info:
-            levels[card["name"].lower().replace(" ", "-").replace(".", "")] = 14 - card["maxLevel"] + card["level"]
-
         # Indicate that this code will take longer to run
         await ctx.defer()
 
         # Adjust algorithm variables based on user input
-        pruning = 1 if pruning == "Yes" else 2
+        pruning = {"Yes": 1, "No": 2, "Exact": 3}.get(pruning, 1)
         variation = 1 if variation == "Yes" else 2
 
-        # Get all decks from the database
-        c = utilities.conn.cursor()
-        decks = c.execute("SELECT * FROM decks").fetchall()
-
         # Create the initial message
         message = await ctx.send("Starting computation...")
 
-        # Get the best deck sets
-        best_decks = await utilities.compute_war_decks(decks_to_return, pruning, variation, include_set,
-                                                       exclude_set, decks_to_generate, decks, levels, message)
+        # Get the best deck sets on the scheduler's worker threads
+        # The decks the player can use are also selected there, from the deck index, which is only loaded again after
+        # the decks change. The best deck sets found so far are shown in the message while the search refines them.
+        def job(progress, cancel):
+            deck_index, decks = utilities.get_candidate_decks_on_thread(levels, exclude_set)
+            return utilities.search_war_decks(decks_to_return, pruning, variation, include_set, exclude_set,
+                                              decks_to_generate, decks, levels, progress,
+                                              compatibility=deck_index.compatibility, cancel=cancel,
+                                              decks_version=deck_index.version, deadline=SEARCH_DEADLINE,
+                                              on_result=lambda best: progress(describe_best_so_far(best)),
+                                              profile_path=utilities.search_profile_path(tag),
+                                              deck_index=deck_index)
+
+        try:
+            best_decks = await scheduler.submit(ctx.author.id, job, message.edit)
+        except UserLimitError:
+            await message.edit("You already have war decks generating, please wait for them to finish...")
+            return
+        except QueueFullError:
+            await message.edit("Too many war decks are generating right now, please try again later...")
+            return
+        except TimeoutError:
+            await message.edit("War deck generation took too long, try again with pruning enabled...")
+            return
+        except JobCancelledError:
+            await message.edit("War deck generation cancelled...")
+            return
+        print("Result cache hit rate: %d%%" % round(utilities.result_cache_hit_ratio() * 100))
 
         # Return the best decks
         ret = []
@@ -152,6 +251,21 @@ async def generate_war_decks(ctx: discord.ApplicationContext, tag: str, decks_to
         await ctx.send_followup("Error occurred, please try again later")
 
 
+@bot.slash_command(name="cancel_war_decks", description="Cancel your war deck generation")
+async def cancel_war_decks(ctx: discord.ApplicationContext):
+    if scheduler.cancel(ctx.author.id) > 0:
+        await ctx.respond("Cancelled your war deck generation.", ephemeral=True)
+    else:
+        await ctx.respond("You have no war decks generating.", ephemeral=True)
+
+
+# This function fetches and parses a RoyaleAPI deck stats page, it blocks so it is run off the event loop
+def fetch_deck_info(link: str) -> dict:
+    import extract
+    response = utilities.get_session().get(link, timeout=utilities.HTTP_TIMEOUT)
+    return extract.parse_deck_info(response.text)
+
+
 @bot.slash_command(name="load_deck_info", description="Load info for a particular deck")
 @option("link", description="The RoyaleAPI link to the deck")
 @option("name", description="The name of the deck")
@@ -162,9 +276,7 @@ async def load_deck_info(ctx: discord.ApplicationContext, link: str, name: str,
                          show_battle_outcomes: str = "No", show_challenge_wins: str = "No"):
     try:
         # Get the deck info from RoyaleAPI
-        session = requests.Session()
-        response = session.get(link, headers={"user-agent": "Mozilla/5.0"})
-        html = lxml.html.fromstring(response.text)
+        info = await asyncio.to_thread(fetch_deck_info, link)
 
         # Create the initial embed
         embed = discord.Embed(
@@ -178,7 +290,7 @@ async def load_deck_info(ctx: discord.ApplicationContext, link: str, name: str,
         if show_battle_outcomes == "Yes":
             # Add battle outcome info
             embed.add_field(name="Battle Outcomes", value="", inline=False)
-            outcomes = html.cssselect(".ui.very.basic.compact.stats.unstackable.table")[0].xpath("tbody/tr/*/text()")
+            outcomes = info["outcomes"]
             embed.add_field(name="", value=f"__{outcomes[0]}__\n{outcomes[1]} | {outcomes[2]}", inline=True)
             embed.add_field(name="", value="", inline=True)  # Padding
             embed.add_field(name="", value=f"__{outcomes[3]}__\n{outcomes[4]} | {outcomes[5]}", inline=True)
@@ -191,23 +303,18 @@ async def load_deck_info(ctx: discord.ApplicationContext, link: str, name: str,
             # Add CC and GC win info
             embed.add_field(name="CC and GC Wins", value="", inline=False)
             win_timeframe = ["7d", "28d"]
-            for idx, row in enumerate(html.cssselect(".item.cc")):
-                arr = row.xpath("div/*/text()")
-                embed.add_field(name="",
-                                value=f"__CC Wins | {win_timeframe[idx]}__\n{arr[2].strip()}", inline=True)
+            for idx, wins in enumerate(info["cc_wins"]):
+                embed.add_field(name="", value=f"__CC Wins | {win_timeframe[idx]}__\n{wins}", inline=True)
                 if idx == 0:
                     embed.add_field(name="", value="", inline=True)  # Padding
-            for idx, row in enumerate(html.cssselect(".item.gc")):
-                arr = row.xpath("div/*/text()")
-                embed.add_field(name="",
-                                value=f"__GC Wins | {win_timeframe[idx]}__\n{arr[2].strip()}", inline=True)
+            for idx, wins in enumerate(info["gc_wins"]):
+                embed.add_field(name="", value=f"__GC Wins | {win_timeframe[idx]}__\n{wins}", inline=True)
                 if idx == 0:
                     embed.add_field(name="", value="", inline=True)  # Padding
             embed.add_field(name="", value="", inline=False)  # Padding
 
         # Add the in-game link
-        game_link = html.cssselect(".ui.blue.icon.circular.button.button_popup")[0].get("href")
-        embed.add_field(name="", value=f"__**[Copy deck in-game]({game_link})**__", inline=False)  # Padding
+        embed.add_field(name="", value=f"__**[Copy deck in-game]({info['game_link']})**__", inline=False)  # Padding
 
         # Add the deck image
         embed.set_image(
@@ -225,26 +332,32 @@ async def load_deck_info(ctx: discord.ApplicationContext, link: str, name: str,
 
 
 # Get the latest meta decks every 24 hours
-# Also deletes old decks
+# Also deletes old decks. Both run on another thread with its own database connection, so that the bot keeps
+# answering while the pages are fetched and written
 @tasks.loop(hours=24)
 async def update_decks():
     print("Updating deck list...\t\t\t\t", datetime.now())
-    c = utilities.conn.cursor()
-    num_cards = len(c.execute("SELECT * FROM cards").fetchall())
+    num_cards = utilities.conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+    from alive_progress import alive_bar
     with alive_bar(num_cards) as bar:
-        for row in c.execute("SELECT * FROM cards"):
-            utilities.load_deck("https://royaleapi.com/decks/popular?type=GC&time=7d&size=20&inc=" + row[0])
-            bar()
-    c.execute("DELETE FROM decks WHERE entry_date < date('now', '-60 day')")  # Delete decks older than 60 days
-    utilities.conn.commit()
+        written = await asyncio.to_thread(scraper.update_all_decks, 60, bar)  # Delete decks older than 60 days
+    print("Loaded %d decks, cache stats %s" % (written, http_cache.stats))
     print("Decks updated...\t\t\t\t", datetime.now())
 
 
-# Get the latest card list every 24 hours
-# This ensures that any newly released card is in the database quickly
-@tasks.loop(hours=24)
+# Update the age decay of the decks whose age in days rolled over every hour
+# Scores stay right without it, but the stored decay saves working out the age of every deck for every request
+@tasks.loop(hours=1)
+async def refresh_deck_scores():
+    utilities.refresh_deck_scores()
+
+
+# Get the latest card list once it is older than CARDS_MAX_AGE, checked every hour
+# This ensures that any newly released card is in the database quickly, and the card list is updated on a background
+# thread so that the bot never waits on it
+@tasks.loop(hours=1)
 async def update_cards():
-    utilities.update_cards()
+    utilities.load_cards()
 
 
 # Printing a message when the bot has been loaded
@@ -256,15 +369,21 @@ async def on_ready():
         utilities.create_connection()
         assert utilities.conn is not None
 
-        # Create the cards table if it doesn't already exist
-        create_table(utilities.SQL_CREATE_CARDS_TABLE)
+        # Create the tables and bring them up to date, which is skipped once the database is up to date
+        utilities.update_schema()
+
+        # Load the deck index on another thread, from the deck snapshot if it is up to date, so that the first request
+        # doesn't wait
+        await asyncio.to_thread(utilities.get_deck_index_on_thread)
 
-        # Create the decks table if it doesn't already exist
-        create_table(utilities.SQL_CREATE_DECKS_TABLE)
+        # Start taking war deck generation jobs
+        scheduler.start()
 
         # Start tasks if they aren't in progress
         if not update_cards.is_running():
             update_cards.start()
+        if not refresh_deck_scores.is_running():
+            refresh_deck_scores.start()
         #if not update_decks.is_running():
         #    update_decks.start()
 
@@ -274,4 +393,5 @@ async def on_ready():
 
 
 # Running the bot
-bot.run(utilities.DISCORD_BOT_TOKEN)  # Run the bot with the token
+if __name__ == "__main__":
+    bot.run(utilities.DISCORD_BOT_TOKEN)  # Run the bot with the token
@@ -0,0 +1,56 @@
+# Import Statements
+import lxml.cssselect
+import lxml.etree
+import lxml.html
+import time
+
+# The selectors and XPath expressions used on RoyaleAPI pages, compiled once when the module is loaded
+# Popular decks pages have a grid per deck, holding a link to the deck's stats page and a table of its stats
+# The grid selector only looks at divs and checks the rarest class first, which matches the same elements as
+# ".ui.two.column.stackable.padded.grid" in half the time
+DECK_SELECTOR = lxml.cssselect.CSSSelector("div.stackable.ui.two.column.padded.grid")
+DECK_LINK_XPATH = lxml.etree.XPath("(.//a[starts-with(@href, '/decks/stats/')]/@href)[1]")
+DECK_STATS_XPATH = lxml.etree.XPath("div/div/div/div/table/tbody/tr/*/text()")
+
+# Deck stats pages have a table of battle outcomes, the challenge wins over two time frames and an in-game link
+OUTCOMES_SELECTOR = lxml.cssselect.CSSSelector(".ui.very.basic.compact.stats.unstackable.table")
+OUTCOMES_XPATH = lxml.etree.XPath("tbody/tr/*/text()")
+CC_WINS_SELECTOR = lxml.cssselect.CSSSelector(".item.cc")
+GC_WINS_SELECTOR = lxml.cssselect.CSSSelector(".item.gc")
+WINS_XPATH = lxml.etree.XPath("div/*/text()")
+GAME_LINK_SELECTOR = lxml.cssselect.CSSSelector(".ui.blue.icon.circular.button.button_popup")
+
+# The length of the path before the deck id in a deck's stats link
+DECK_LINK_PREFIX = len("/decks/stats/")
+
+
+# This function extracts the deck rows from a RoyaleAPI popular decks page
+# It only depends on this module, so that it can run in worker processes without loading the rest of the program
+def parse_deck_page(text: str) -> list:
+    rows = []
+    html = lxml.html.document_fromstring(text)
+    entry_time = int(time.time())
+    for element in DECK_SELECTOR(html):
+        deck_id = str(DECK_LINK_XPATH(element)[0])[DECK_LINK_PREFIX:]
+        cards = deck_id.split(",")
+        stats = DECK_STATS_XPATH(element)
+        rating = int(stats[0].strip())
+        usage = int(stats[5].strip().replace(',', ''))
+        win_rate = float(stats[2].strip()[:-1])
+        rows.append((deck_id, cards[0], cards[1], cards[2], cards[3], cards[4], cards[5], cards[6], cards[7], rating,
+                     usage, win_rate, entry_time))
+    return rows
+
+
+# This function extracts the battle outcomes, the CC and GC wins and the in-game link from a RoyaleAPI deck stats page
+# The outcomes are label, value, value triples, and the wins are the text of each time frame in order
+# Raises IndexError if the page has no in-game link, such as when the deck doesn't exist
+def parse_deck_info(text: str) -> dict:
+    html = lxml.html.document_fromstring(text)
+    outcomes = OUTCOMES_SELECTOR(html)
+    return {
+        "outcomes": OUTCOMES_XPATH(outcomes[0]) if len(outcomes) > 0 else [],
+        "cc_wins": [WINS_XPATH(row)[2].strip() for row in CC_WINS_SELECTOR(html)],
+        "gc_wins": [WINS_XPATH(row)[2].strip() for row in GC_WINS_SELECTOR(html)],
+        "game_link": GAME_LINK_SELECTOR(html)[0].get("href")
+    }
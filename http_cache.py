@@ -0,0 +1,168 @@
+# Import Statements
+from dataclasses import dataclass, field
+import hashlib
+import json
+import metrics
+import os
+import threading
+import time
+
+# The directory the cached responses are stored in
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", ".http_cache")
+
+# Set to 0 to turn the cache off
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1") != "0"
+
+# How long a cached response is used without asking the server, as (URL substring, seconds) pairs
+# The first matching pair is used, and URLs that match none are revalidated every time
+HTTP_CACHE_TTLS = [
+    ("cards.json", 24 * 60 * 60),
+    ("/decks/popular", 60 * 60),
+]
+
+# The cache hit and miss counts
+# A hit is served straight from the disk, a revalidation is a 304 from the server, and a miss is a full download
+stats = {"hits": 0, "revalidated": 0, "misses": 0}
+stats_lock = threading.Lock()
+
+
+# The result of a cached fetch
+@dataclass
+class CachedResponse:
+    url: str
+    status_code: int
+    text: str
+    modified: bool  # False if the body is the same as the last time the URL was fetched
+    data: dict = field(default_factory=dict)  # What was saved with the body by save_data, empty if it was modified
+
+    # This function raises an exception if the request failed, like requests.Response.raise_for_status
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError("HTTP %d for %s" % (self.status_code, self.url))
+
+    # This function decodes the body as JSON
+    def json(self):
+        return json.loads(self.text)
+
+
+# This function gets the time to live of a URL in seconds
+def get_ttl(url: str) -> int:
+    for pattern, ttl in HTTP_CACHE_TTLS:
+        if pattern in url:
+            return ttl
+    return 0
+
+
+# This function gets the paths of the metadata and body files of a URL
+def entry_paths(url: str) -> (str, str):
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(HTTP_CACHE_DIR, key + ".json"), os.path.join(HTTP_CACHE_DIR, key + ".body")
+
+
+# This function increments one of the cache stats
+def count(stat: str):
+    with stats_lock:
+        stats[stat] += 1
+    metrics.inc("http_cache_total", result=stat)
+
+
+# This function returns the share of requests that didn't need a full download
+def hit_ratio() -> float:
+    with stats_lock:
+        total = stats["hits"] + stats["revalidated"] + stats["misses"]
+        return 0.0 if total == 0 else (stats["hits"] + stats["revalidated"]) / total
+
+
+metrics.register_gauge("http_cache_hit_ratio", hit_ratio)
+
+
+# This function gets a URL through the cache
+# Fresh responses come straight from the disk, and stale ones are revalidated with their ETag and Last-Modified headers
+# before_request is called right before anything is sent to the server, such as to wait on a rate limiter
+def fetch(session, url: str, timeout: float | None = None, before_request=None) -> CachedResponse:
+    if not HTTP_CACHE_ENABLED:
+        if before_request is not None:
+            before_request()
+        response = session.get(url, timeout=timeout)
+        count("misses")
+        return CachedResponse(url, response.status_code, response.text, True)
+
+    meta_path, body_path = entry_paths(url)
+    meta = None
+    try:
+        with open(meta_path) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        pass
+
+    if meta is not None and time.time() - meta["fetched"] < get_ttl(url):
+        try:
+            with open(body_path, encoding="utf-8") as file:
+                text = file.read()
+            count("hits")
+            return CachedResponse(url, 200, text, False, meta.get("data", {}))
+        except OSError:
+            meta = None
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    if before_request is not None:
+        before_request()
+    response = session.get(url, headers=headers, timeout=timeout)
+
+    if response.status_code == 304 and meta is not None:
+        try:
+            with open(body_path, encoding="utf-8") as file:
+                text = file.read()
+            meta["fetched"] = time.time()
+            write_entry(meta_path, json.dumps(meta).encode())
+            count("revalidated")
+            return CachedResponse(url, 200, text, False, meta.get("data", {}))
+        except OSError:
+            response = session.get(url, timeout=timeout)
+
+    count("misses")
+    text = response.text
+    if response.status_code != 200:
+        return CachedResponse(url, response.status_code, text, True)
+
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    modified = meta is None or meta.get("sha256") != digest
+    write_entry(body_path, text.encode("utf-8"))
+    write_entry(meta_path, json.dumps({
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": digest,
+        "fetched": time.time(),
+        "data": {} if modified else meta.get("data", {})
+    }).encode())
+    return CachedResponse(url, 200, text, modified, {} if modified else meta.get("data", {}))
+
+
+# This function saves data with the cached body of a URL, such as what was parsed from it, so that it can be used
+# without parsing the body again for as long as the body doesn't change
+def save_data(url: str, data: dict):
+    if not HTTP_CACHE_ENABLED:
+        return
+    meta_path, _ = entry_paths(url)
+    try:
+        with open(meta_path) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return
+    meta["data"] = data
+    write_entry(meta_path, json.dumps(meta).encode())
+
+
+# This function atomically writes a cache file, so that readers never see a partly written file
+def write_entry(path: str, data: bytes):
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    temp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
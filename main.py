@@ -1,7 +1,7 @@
 # Package Imports
 
-from alive_progress import alive_bar
-import asyncio
+import http_cache
+import scraper
 import statistics
 import sqlite3
 import utilities
@@ -26,14 +26,14 @@ def load_decks(conn: sqlite3.Connection):
     try:
         match option:
             case "1":
-                utilities.load_deck("https://royaleapi.com/decks/popular?type=GC&time=7d&size=20")
+                utilities.load_deck(utilities.popular_decks_url())
                 print("Decks successfully loaded!\n")
                 load_decks(conn)
             case "2":
                 card = input("Enter the card you would like to include: ").lower().replace(" ", "-")
                 c = conn.cursor()
                 if c.execute("SELECT 1 FROM cards WHERE id='" + card + "'").fetchone():
-                    utilities.load_deck("https://royaleapi.com/decks/popular?type=GC&time=7d&size=20&inc=" + card)
+                    utilities.load_deck(utilities.popular_decks_url(card))
                     print("Decks successfully loaded!\n")
                     load_decks(conn)
                 else:
@@ -42,10 +42,11 @@ def load_decks(conn: sqlite3.Connection):
             case "3":
                 c = conn.cursor()
                 num_cards = len(c.execute("SELECT * FROM cards").fetchall())
+                from alive_progress import alive_bar
                 with alive_bar(num_cards) as bar:
-                    for row in c.execute("SELECT * FROM cards"):
-                        utilities.load_deck("https://royaleapi.com/decks/popular?type=GC&time=7d&size=20&inc=" + row[0])
-                        bar()
+                    written = scraper.scrape_all_cards(progress=bar)
+                print("Loaded %d decks, %d%% of pages unchanged since the last load\n" %
+                      (written, round(http_cache.hit_ratio() * 100)))
             case "4":
                 print("Returning to main screen...\n")
                 return
@@ -57,22 +58,24 @@ def load_decks(conn: sqlite3.Connection):
 
 
 # This function actually performs the generation
+# With profile_dir, a cProfile of the search is saved to that directory
 def generate(tag: str, decks_to_return: int, pruning: int, variation: int, include_set: set,
-             exclude_set: set, decks_to_generate: int):
-    # Get all decks from the database
-    c = utilities.conn.cursor()
-    decks = c.execute("SELECT * FROM decks").fetchall()
-
-    # Get the levels from the database and convert them to a dictionary
-    levels_obj = c.execute("SELECT * FROM levels WHERE id='" + tag + "'").fetchone()
-    levels_columns = [(row[1]) for row in c.execute("PRAGMA table_info(levels)").fetchall()]
-    levels = {}
-    for i in range(1, len(levels_obj)):
-        levels[levels_columns[i].replace("_", "-")] = levels_obj[i]
+             exclude_set: set, decks_to_generate: int, profile_dir: str = ""):
+    # Get the levels from the database as a dictionary
+    levels = utilities.get_player_levels(tag)
+
+    # Get the decks the player can use, as decks of the deck index
+    deck_index = utilities.get_deck_index()
+    decks = utilities.get_candidate_decks(deck_index, levels, exclude_set)
 
     # Get the best deck sets
+    import asyncio
     best_decks = asyncio.run(utilities.compute_war_decks(decks_to_return, pruning, variation, include_set, exclude_set,
-                                                         decks_to_generate, decks, levels, None))
+                                                         decks_to_generate, decks, levels,
+                                                         compatibility=deck_index.compatibility,
+                                                         decks_version=deck_index.version, deck_index=deck_index,
+                                                         profile_path=utilities.search_profile_path(tag, profile_dir)))
+    print("Result cache hit rate: %d%%" % round(utilities.result_cache_hit_ratio() * 100))
 
     # Print out the best decks
     for idx, cur_decks in enumerate(best_decks):
@@ -93,12 +96,11 @@ def generate(tag: str, decks_to_return: int, pruning: int, variation: int, inclu
 
 
 # Generates optimal war decks
-def generate_war_decks(tag: str):
-    c = utilities.conn.cursor()
+def generate_war_decks(tag: str, profile_dir: str = ""):
     if tag[0] != '#':
         tag = '#' + tag
     tag = tag.upper()
-    levels = c.execute("SELECT * FROM levels WHERE id='" + tag + "'").fetchone()
+    levels = utilities.get_player_levels(tag)
 
     if not levels:
         print("Player tag not loaded, returning to main screen...\n")
@@ -109,8 +111,8 @@ def generate_war_decks(tag: str):
     if decks_to_return is None:
         return
 
-    pruning = utilities.get_integer(1, 3, "Do you want to use iterative pruning?\n(1) Yes\n(2) No\n(3) Quit\n",
-                                    "3")
+    pruning = utilities.get_integer(1, 4, "Do you want to use iterative pruning?\n(1) Yes\n(2) No\n(3) Exact search "
+                                          "(always finds the best deck sets)\n(4) Quit\n", "4")
     if pruning is None:
         return
 
@@ -170,11 +172,17 @@ def generate_war_decks(tag: str):
     if decks_to_generate is None:
         return
 
-    generate(tag, decks_to_return, pruning, variation, include_set, exclude_set, decks_to_generate)
+    generate(tag, decks_to_return, pruning, variation, include_set, exclude_set, decks_to_generate, profile_dir)
 
 
 # The driver code for the program
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Clash Royale War Deck Builder")
+    parser.add_argument("--profile", default=utilities.SEARCH_PROFILE_DIR, metavar="DIRECTORY",
+                        help="save a cProfile of every war deck search to this directory")
+    args = parser.parse_args()
+
     # Create the connection and ensure that it is valid
     utilities.create_connection()
     if not isinstance(utilities.conn, sqlite3.Connection):
@@ -186,17 +194,11 @@ def main():
           "Supercell is not responsible for it.\nFor more information see Supercell’s Fan Content "
           "Policy:\nhttps://supercell.com/en/fan-content-policy/en/\n")
 
-    # Create the cards table if it doesn't already exist
-    utilities.create_table(utilities.SQL_CREATE_CARDS_TABLE)
-
-    # Fill in the cards table with the cards from Clash Royale
-    utilities.update_cards()
-
-    # Create the decks table if it doesn't already exist
-    utilities.create_table(utilities.SQL_CREATE_DECKS_TABLE)
+    # Create the tables and bring them up to date, which is skipped once the database is up to date
+    utilities.update_schema()
 
-    # Create and update the levels table if necessary
-    utilities.update_levels_table()
+    # Fill in the cards table with the cards from Clash Royale, updating them in the background if they are stale
+    utilities.load_cards()
 
     # Start the menu
     option = "0"
@@ -217,7 +219,7 @@ def main():
                 load_decks(utilities.conn)
             case "3":
                 tag = input("Please input your player tag: ")
-                generate_war_decks(tag)
+                generate_war_decks(tag, args.profile)
             case "4":
                 print("Exiting program...")
                 utilities.conn.close()
@@ -0,0 +1,156 @@
+# Import Statements
+import cProfile
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+# Set to 1 to collect metrics, which costs next to nothing when it is off
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# If set, every event is appended to this file as a line of JSON
+METRICS_LOG = os.getenv("METRICS_LOG")
+
+# If set, the metrics are written to this file in the Prometheus text format every time they are flushed
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE")
+
+# The counters and timers, from (name, labels) to a count, or to a [count, total seconds] pair for timers
+counters = {}
+timers = {}
+
+# Functions that give the current value of a gauge, such as a cache hit ratio, from name to function
+gauges = {}
+
+lock = threading.Lock()
+
+# A timer that does nothing, handed out while metrics are off
+null_timer = nullcontext()
+
+
+# This function gets the key of a metric from its name and labels
+def metric_key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+# This function adds to a counter
+def inc(name: str, value: float = 1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = metric_key(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+# This function records a duration in seconds
+def observe(name: str, seconds: float, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = metric_key(name, labels)
+    with lock:
+        entry = timers.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+# This function times the block it wraps, as in "with metrics.timer('search_seconds', stage='beam'):"
+def timer(name: str, **labels):
+    return timed(name, labels) if METRICS_ENABLED else null_timer
+
+
+@contextmanager
+def timed(name: str, labels: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+# This function registers a gauge that is read whenever the metrics are looked at
+def register_gauge(name: str, func):
+    gauges[name] = func
+
+
+# This function gets every metric as a dictionary that can be turned into JSON
+def snapshot() -> dict:
+    with lock:
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in counters.items()],
+            "timers": [{"name": name, "labels": dict(labels), "count": count, "seconds": total}
+                       for (name, labels), (count, total) in timers.items()],
+            "gauges": {name: func() for name, func in gauges.items()}
+        }
+
+
+# This function clears every counter and timer
+def reset():
+    with lock:
+        counters.clear()
+        timers.clear()
+
+
+# This function appends an event to the JSON log, if there is one
+def log_event(event: str, **fields):
+    if not METRICS_ENABLED or METRICS_LOG is None:
+        return
+    line = json.dumps({"time": time.time(), "event": event, **fields}, default=str)
+    with lock:
+        with open(METRICS_LOG, "a") as file:
+            file.write(line + "\n")
+
+
+# This function formats the labels of a metric for the Prometheus text format
+def format_labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for key, value in labels)
+
+
+# This function gets every metric in the Prometheus text format
+def prometheus_text() -> str:
+    lines = []
+    with lock:
+        for name in sorted({name for name, _ in counters}):
+            lines.append("# TYPE %s counter" % name)
+            lines.extend("%s%s %s" % (name, format_labels(labels), value)
+                         for (key, labels), value in counters.items() if key == name)
+        for name in sorted({name for name, _ in timers}):
+            lines.append("# TYPE %s summary" % name)
+            for (key, labels), (count, total) in timers.items():
+                if key == name:
+                    lines.append("%s_count%s %d" % (name, format_labels(labels), count))
+                    lines.append("%s_sum%s %f" % (name, format_labels(labels), total))
+    for name, func in sorted(gauges.items()):
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s %f" % (name, func()))
+    return "\n".join(lines) + "\n"
+
+
+# This function writes the Prometheus file, if there is one
+# The file is replaced atomically so that a scraper never reads it half written
+def flush():
+    if not METRICS_ENABLED or METRICS_PROM_FILE is None:
+        return
+    temp_path = "%s.%d.tmp" % (METRICS_PROM_FILE, threading.get_ident())
+    with open(temp_path, "w") as file:
+        file.write(prometheus_text())
+    os.replace(temp_path, METRICS_PROM_FILE)
+
+
+# This function profiles the block it wraps with cProfile and saves the stats to path, if path is given
+# It works whether metrics are on or not, so that a single slow request can be looked into
+@contextmanager
+def profile(path: str | None):
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,60 @@
+# Import Statements
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+import os
+from scraper import TokenBucket
+import utilities
+
+# Number of players fetched at once, and maximum requests per second to the player API
+PLAYERS_CONCURRENCY = int(os.getenv("PLAYERS_CONCURRENCY", "8"))
+PLAYERS_RATE = float(os.getenv("PLAYERS_RATE", "10"))
+
+
+# This function normalizes a player tag to an upper case tag starting with #
+def normalize_tag(tag: str) -> str:
+    return "#" + tag.strip().lstrip("#").upper()
+
+
+# This function fetches a player's cards from the player API, returning None if the player doesn't exist
+# Requests that fail with 429 or a 5xx status are retried with backoff by the shared session, honoring Retry-After
+def fetch_player_cards(tag: str, bucket: TokenBucket) -> list | None:
+    bucket.acquire()
+    with metrics.timer("load_levels_seconds", stage="fetch"):
+        response = utilities.get_session().get(utilities.player_url(tag), headers=utilities.player_api_headers(),
+                                               timeout=utilities.HTTP_TIMEOUT)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()["cards"]
+
+
+# This function loads the levels of many players from the player API and saves them all in a single transaction
+# Players are fetched concurrently on worker threads over the shared connection pool, with at most rate requests per
+# second, and card names are converted with the card name map. progress is called once for every player that is done.
+# Returns a dictionary from every normalized tag to the player's levels, or to None if the player couldn't be loaded
+def load_players(tags: list, concurrency: int = PLAYERS_CONCURRENCY, rate: float = PLAYERS_RATE,
+                 progress=None) -> dict:
+    tags = list(dict.fromkeys(normalize_tag(tag) for tag in tags))
+    bucket = TokenBucket(rate, max(1, concurrency))
+    names = utilities.get_card_names()
+    players = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch_player_cards, tag, bucket): tag for tag in tags}
+        for future in as_completed(futures):
+            tag = futures[future]
+            try:
+                cards = future.result()
+                players[tag] = None if cards is None else utilities.player_levels_from_cards(cards, names)
+                metrics.inc("players_loaded_total", result="ok" if cards is not None else "not_found")
+            except Exception as e:
+                print(e)
+                print("Could not load levels for player %s..." % tag)
+                players[tag] = None
+                metrics.inc("players_loaded_total", result="failed")
+            if progress is not None:
+                progress()
+
+    with metrics.timer("load_levels_seconds", stage="save"):
+        utilities.save_many_levels({tag: levels for tag, levels in players.items() if levels is not None})
+    metrics.flush()
+    return players
@@ -0,0 +1,132 @@
+# Import Statements
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import threading
+
+
+# Raised when a job is submitted while the queue is full
+class QueueFullError(Exception):
+    pass
+
+
+# Raised when a user submits a job while they already have the maximum number of jobs queued or running
+class UserLimitError(Exception):
+    pass
+
+
+# Raised when a job is cancelled before it finishes
+class JobCancelledError(Exception):
+    pass
+
+
+# A queued or running job, compared by identity
+@dataclass(eq=False)
+class Job:
+    user_id: int
+    func: callable  # Called as func(progress, cancel) in a worker thread
+    on_progress: callable  # Coroutine function called on the event loop with each progress update
+    result: asyncio.Future
+    cancel: threading.Event = field(default_factory=threading.Event)
+
+
+# This class runs CPU-heavy jobs, such as war deck generation, on a pool of worker threads
+# Jobs wait in a bounded queue, each user can only have a limited number of jobs at once, and a job that runs longer
+# than the timeout is cancelled. Progress updates from the workers are sent back to the event loop.
+class JobScheduler:
+    def __init__(self, workers: int, queue_size: int, user_limit: int, timeout: float):
+        self.workers = workers
+        self.user_limit = user_limit
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.queue = None
+        self.queue_size = queue_size
+        self.jobs = {}  # The queued and running jobs of each user
+        self.tasks = []
+
+    # This function starts the tasks that take jobs off the queue, it must be called from the event loop
+    def start(self):
+        if len(self.tasks) > 0:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self.run_jobs()))
+
+    # This function submits a job and waits for its result
+    # It raises QueueFullError, UserLimitError, TimeoutError or JobCancelledError if the job can't be completed
+    async def submit(self, user_id: int, func: callable, on_progress: callable = None):
+        self.start()
+        if len(self.jobs.get(user_id, [])) >= self.user_limit:
+            raise UserLimitError()
+
+        job = Job(user_id, func, on_progress, asyncio.get_running_loop().create_future())
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError()
+        self.jobs.setdefault(user_id, []).append(job)
+        try:
+            return await job.result
+        except asyncio.CancelledError:
+            job.cancel.set()
+            self.forget(job)
+            raise
+
+    # This function cancels every queued and running job of a user, returning the number of jobs cancelled
+    # The jobs stop counting towards the user's limit right away, even though a running job's thread may take a moment
+    # to stop and a queued job only leaves the queue once a worker takes it
+    def cancel(self, user_id: int) -> int:
+        jobs = self.jobs.pop(user_id, [])
+        for job in jobs:
+            job.cancel.set()
+            if not job.result.done():
+                job.result.set_exception(JobCancelledError())
+        return len(jobs)
+
+    # This function removes a job from the jobs of its user, if it is still there
+    def forget(self, job: Job):
+        jobs = self.jobs.get(job.user_id)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            if len(jobs) == 0:
+                del self.jobs[job.user_id]
+
+    # This function returns the number of jobs waiting in the queue
+    def queued(self) -> int:
+        return 0 if self.queue is None else self.queue.qsize()
+
+    # This function takes jobs off the queue and runs them one at a time
+    async def run_jobs(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                if not job.cancel.is_set():
+                    await self.run_job(loop, job)
+            finally:
+                self.forget(job)
+                self.queue.task_done()
+
+    # This function runs a single job in the thread pool
+    async def run_job(self, loop: asyncio.AbstractEventLoop, job: Job):
+        def progress(text: str):
+            if job.on_progress is not None and not job.cancel.is_set():
+                asyncio.run_coroutine_threadsafe(job.on_progress(text), loop)
+
+        future = loop.run_in_executor(self.executor, job.func, progress, job.cancel)
+        done, _ = await asyncio.wait({future}, timeout=self.timeout)
+        if len(done) == 0:
+            # Let the job know that it should stop, and wait for the thread to be free before taking another job
+            job.cancel.set()
+            if not job.result.done():
+                job.result.set_exception(TimeoutError())
+            self.forget(job)
+            await asyncio.wait({future})
+
+        if job.result.done():
+            # The job timed out or was cancelled, so its outcome is discarded
+            future.exception()
+        elif future.exception() is not None:
+            job.result.set_exception(future.exception())
+        else:
+            job.result.set_result(future.result())
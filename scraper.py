@@ -0,0 +1,137 @@
+# Import Statements
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import http_cache
+import metrics
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import utilities
+
+# Number of pages fetched at once, maximum requests per second, and number of deck rows written per transaction
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))
+SCRAPE_RATE = float(os.getenv("SCRAPE_RATE", "10"))
+SCRAPE_BATCH_SIZE = int(os.getenv("SCRAPE_BATCH_SIZE", "500"))
+
+# Number of worker processes that parse the fetched pages, 0 to parse them on the threads that fetch them
+# Pages are parsed on the fetching threads by default, since benchmarks/bench_extract.py parses them faster on threads
+# than on worker processes, which also have to import the main module again when they start
+SCRAPE_PARSE_WORKERS = int(os.getenv("SCRAPE_PARSE_WORKERS", "0"))
+
+
+# This class is a thread-safe token bucket rate limiter
+# Tokens are added at rate per second up to burst, and every request takes one token
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # This function waits until a token is available and takes it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# This function fetches and parses a single popular decks page, returning its deck rows and the ids of the decks on it
+# that weren't parsed again
+# Pages that haven't changed since they were last loaded are not parsed again, and the ids of their decks are taken
+# from the cache instead. With a parser, the page is parsed in one of its worker processes, so that parsing doesn't
+# hold the GIL that the fetching threads need
+def fetch_decks(url: str, bucket: TokenBucket, parser: Executor | None = None) -> (list, list):
+    with metrics.timer("load_deck_seconds"):
+        response = http_cache.fetch(utilities.get_session(), url, utilities.HTTP_TIMEOUT, bucket.acquire)
+        response.raise_for_status()
+        if not response.modified and "deck_ids" in response.data:
+            return [], response.data["deck_ids"]
+        with metrics.timer("parse_page_seconds"):
+            import extract
+            if parser is None:
+                rows = extract.parse_deck_page(response.text)
+            else:
+                rows = parser.submit(extract.parse_deck_page, response.text).result()
+        http_cache.save_data(url, {"deck_ids": [row[0] for row in rows]})
+        return rows, []
+
+
+# This function scrapes the given pages concurrently and loads their decks into the database
+# Pages are fetched on worker threads over the shared connection pool and parsed on those threads, or on parse_workers
+# worker processes if there are any, while this thread is the only writer, writing the rows in batches of batch_size
+# through the given connection or else the shared one. progress is called once for every page that is done. The decks
+# of pages that haven't changed are marked as seen again. Returns the number of deck rows written
+def scrape_decks(urls: list, concurrency: int = SCRAPE_CONCURRENCY, rate: float = SCRAPE_RATE,
+                 batch_size: int = SCRAPE_BATCH_SIZE, progress=None, parse_workers: int = SCRAPE_PARSE_WORKERS,
+                 connection: sqlite3.Connection | None = None) -> int:
+    bucket = TokenBucket(rate, max(1, concurrency))
+    batch = []
+    unchanged = []
+    written = 0
+    # The parsers are started with spawn, since the scrape can run on a thread other than the main one
+    parser = None
+    if parse_workers > 0 and len(urls) > 1:
+        parser = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(fetch_decks, url, bucket, parser): url for url in urls}
+            for future in as_completed(futures):
+                try:
+                    rows, deck_ids = future.result()
+                    batch.extend(rows)
+                    unchanged.extend(deck_ids)
+                    metrics.inc("scrape_pages_total", result="ok")
+                except Exception as e:
+                    print(e)
+                    print("Could not load decks from %s..." % futures[future])
+                    metrics.inc("scrape_pages_total", result="failed")
+                if len(batch) >= batch_size:
+                    utilities.write_decks(batch, connection)
+                    written += len(batch)
+                    batch = []
+                if progress is not None:
+                    progress()
+    finally:
+        if parser is not None:
+            parser.shutdown()
+    if len(batch) > 0:
+        utilities.write_decks(batch, connection)
+        written += len(batch)
+    utilities.touch_decks(unchanged, connection)
+    if written > 0 or len(unchanged) > 0:
+        utilities.save_deck_snapshot(connection=connection)
+    metrics.inc("decks_loaded_total", written)
+    metrics.flush()
+    return written
+
+
+# This function scrapes the popular decks of every card in the database, through the given connection or else the
+# shared one
+def scrape_all_cards(concurrency: int = SCRAPE_CONCURRENCY, rate: float = SCRAPE_RATE,
+                     batch_size: int = SCRAPE_BATCH_SIZE, progress=None, parse_workers: int = SCRAPE_PARSE_WORKERS,
+                     connection: sqlite3.Connection | None = None) -> int:
+    connection = utilities.conn if connection is None else connection
+    urls = [utilities.popular_decks_url(row[0]) for row in connection.execute("SELECT id FROM cards")]
+    return scrape_decks(urls, concurrency, rate, batch_size, progress, parse_workers, connection)
+
+
+# This function scrapes the popular decks of every card and then deletes the decks older than purge_days days, with
+# its own database connection, so that it can run on any thread while another thread uses the shared one
+# Returns the number of deck rows written
+def update_all_decks(purge_days: int, progress=None) -> int:
+    connection = utilities.open_connection()
+    try:
+        written = scrape_all_cards(progress=progress, connection=connection)
+        utilities.purge_old_decks(purge_days, connection)
+        return written
+    finally:
+        connection.close()
@@ -0,0 +1,134 @@
+# Import Statements
+from array import array
+from collections.abc import Sequence
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+# The deck snapshot is a binary copy of the decks table that is memory-mapped read-only, so that every process reading
+# it shares the same pages and nothing has to be parsed to start using it. It is laid out as:
+#   the header, see HEADER
+#   the card ids, joined by newlines, which the card indices below point into
+#   the 8 card indices of every deck as uint8, in the order of the deck id
+#   the rating, usage and win rate of every deck as float32
+#   the entry time of every deck as int32 seconds since the epoch
+# Every array starts on an 8 byte boundary, and every number is little-endian
+SNAPSHOT_MAGIC = b"WARDECKS"
+SNAPSHOT_FORMAT = 1
+
+# Magic, format, number of decks, number of cards, length of the card ids, decks table version and time written
+HEADER = struct.Struct("<8sIIIIqd")
+
+
+# Raised when a file isn't a deck snapshot this version can read
+class SnapshotError(Exception):
+    pass
+
+
+# This function gets the offset of the next 8 byte boundary
+def align(offset: int) -> int:
+    return offset + -offset % 8
+
+
+# This function writes deck rows, as (id, card_1, ..., card_8, rating, usage, win rate, entry time) tuples, to a
+# snapshot at path, with the card indices taken from card_index
+# The snapshot is written to a temporary file that then replaces the old one, so that processes that have the old one
+# mapped keep reading it unchanged. Every thread writes its own temporary file, so that threads writing the snapshot
+# at the same time don't write into the same file or replace the snapshot with each other's.
+def write_snapshot(path: str, rows: list, card_index: dict, version: int):
+    if len(card_index) > 256:
+        raise SnapshotError("Too many cards for uint8 card indices: %d" % len(card_index))
+    card_ids = "\n".join(sorted(card_index, key=card_index.get)).encode()
+    cards = bytes(card_index[row[i]] for row in rows for i in range(1, 9))
+    stats = array("f", (value for row in rows for value in row[9:12]))
+    entry_times = array("i", (row[12] for row in rows))
+    if sys.byteorder != "little":
+        stats.byteswap()
+        entry_times.byteswap()
+
+    temp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(temp_path, "wb") as file:
+        for data in (HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, len(rows), len(card_index), len(card_ids), version,
+                                 time.time()), card_ids, cards, stats.tobytes(), entry_times.tobytes()):
+            file.write(data)
+            file.write(bytes(-file.tell() % 8))
+    os.replace(temp_path, path)
+
+
+# A read-only view of a deck snapshot, which works as a sequence of rows just like the ones read from the decks table
+# Rows are only made when they are read, and the arrays are views straight into the mapped file
+class DeckSnapshot(Sequence):
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise SnapshotError("Truncated deck snapshot")
+        magic, file_format, num_decks, num_cards, ids_length, self.version, self.created = \
+            HEADER.unpack_from(self.map)
+        if magic != SNAPSHOT_MAGIC or file_format != SNAPSHOT_FORMAT:
+            raise SnapshotError("Not a deck snapshot of format %d" % SNAPSHOT_FORMAT)
+
+        offset = HEADER.size
+        self.card_ids = self.map[offset:offset + ids_length].decode().split("\n") if num_cards > 0 else []
+        offset = align(offset + ids_length)
+        view = memoryview(self.map)
+        self.cards = view[offset:offset + num_decks * 8]
+        offset = align(offset + num_decks * 8)
+        self.stats = view[offset:offset + num_decks * 12].cast("f")
+        offset = align(offset + num_decks * 12)
+        self.entry_times = view[offset:offset + num_decks * 4].cast("i")
+        if offset + num_decks * 4 > len(self.map):
+            raise SnapshotError("Truncated deck snapshot")
+        self.num_decks = num_decks
+        self.scores = None  # The base score of every deck, see base_scores
+
+    def __len__(self) -> int:
+        return self.num_decks
+
+    # This function gets a deck row, with the parts of the score that are stored in the decks table worked out again
+    # The decay is left for static_deck_score to work out from the entry time
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(self.num_decks))]
+        if pos < 0:
+            pos += self.num_decks
+        if not 0 <= pos < self.num_decks:
+            raise IndexError("deck snapshot index out of range")
+        cards = [self.card_ids[idx] for idx in self.cards[pos * 8:pos * 8 + 8]]
+        return (",".join(cards), *cards, int(self.stats[pos * 3]), int(self.stats[pos * 3 + 1]), self.win_rate(pos),
+                self.entry_times[pos], self.base_score(pos), 1.0, 0)
+
+    # This function gets the win rate of a deck exactly as it is stored in the decks table, with one decimal
+    def win_rate(self, pos: int) -> float:
+        return round(self.stats[pos * 3 + 2] * 10) / 10
+
+    # This function gets the part of the score of a deck that is the same for every player, like SQL_INSERT_DECK
+    def base_score(self, pos: int) -> float:
+        return 112 + int(self.stats[pos * 3 + 1]) / 2000 + self.win_rate(pos) / 20
+
+    # This function gets the base score of every deck, worked out the first time it is needed since every search of
+    # the snapshot needs it
+    def base_scores(self) -> array:
+        if self.scores is None:
+            self.scores = array("d", (self.base_score(pos) for pos in range(self.num_decks)))
+        return self.scores
+
+    # This function gets the id of a deck without making the rest of its row
+    def deck_id(self, pos: int) -> str:
+        return ",".join(self.card_ids[idx] for idx in self.cards[pos * 8:pos * 8 + 8])
+
+    # This function gets the card bitmask of a deck, with bit positions that are the card indices of the snapshot
+    def card_mask(self, pos: int) -> int:
+        mask = 0
+        for idx in self.cards[pos * 8:pos * 8 + 8]:
+            mask |= 1 << idx
+        return mask
+
+    # This function unmaps the file, once nothing is using the snapshot anymore
+    def close(self):
+        for view in (self.cards, self.stats, self.entry_times):
+            view.release()
+        self.map.close()
@@ -1,26 +1,85 @@
 # Import Statements
-from alive_progress import alive_it
-import copy
-from datetime import datetime, timezone
-import discord
+# lxml, NumPy, requests and alive_progress are slow to import, so they are only imported by the code that uses
+# them, and the command line starts without loading any of them
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
 from dotenv import load_dotenv
-from functools import cmp_to_key
-from heapq import nlargest
-import lxml.html
-import lxml.cssselect
+import http_cache
+import hashlib
+from heapq import heapify, heappop, heappush, heappushpop, nlargest
+from itertools import compress, count, islice
 import math
+import metrics
+import multiprocessing
 import os
-import requests
+import snapshot
 import sqlite3
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import requests
 
 # API Tokens
 load_dotenv()
 CR_API_TOKEN = os.getenv("CR_API_TOKEN")
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 
+# The RoyaleAPI site that decks are scraped from, and the card list
+ROYALEAPI_URL = os.getenv("ROYALEAPI_URL", "https://royaleapi.com")
+CARDS_URL = os.getenv("CARDS_URL", "https://royaleapi.github.io/cr-api-data/json/cards.json")
+
+# How old the card list in the cards table can get before it is updated in the background at startup, in seconds
+CARDS_MAX_AGE = float(os.getenv("CARDS_MAX_AGE", str(24 * 60 * 60)))
+
+# The Clash Royale API proxy that player levels are loaded from
+PLAYER_API_URL = os.getenv("PLAYER_API_URL", "https://proxy.royaleapi.dev/v1")
+
+# HTTP connection pool size, number of retries, backoff factor in seconds, and timeout in seconds
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "4"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+# The search engine used to generate war decks, either "python" or "numpy"
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "python")
+
+# The number of worker processes the python search engine expands the beam with, 1 to expand it in this process
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "1"))
+
+# The directory a cProfile of every war deck search is saved to, or "" to not profile searches
+SEARCH_PROFILE_DIR = os.getenv("SEARCH_PROFILE_DIR", "")
+
+# The number of war deck results kept in the result cache, and how long they are kept for in seconds
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "128"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "600"))
+
+# With a deadline or a result callback, the least width of the narrow beam that finds the first deck sets, and the
+# least time in seconds between the deck sets the exact search reports
+ANYTIME_BEAM_WIDTH = int(os.getenv("ANYTIME_BEAM_WIDTH", "5"))
+ANYTIME_REPORT_INTERVAL = float(os.getenv("ANYTIME_REPORT_INTERVAL", "1"))
+
+# With variation, the exact search first keeps this many optimal sets per returned set to pick varied sets from, and
+# keeps twice as many each time that isn't enough
+EXACT_VARIATION_POOL = 20
+
 # SQLite database name
 DB_FILE_NAME = "database.db"
 
+# SQLite synchronous setting, NORMAL is safe with write-ahead logging and much faster than FULL
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+
+# The deck compatibility index is only kept for deck tables up to this size
+COMPATIBILITY_INDEX_MAX_DECKS = int(os.getenv("COMPATIBILITY_INDEX_MAX_DECKS", "20000"))
+
+# Where the deck snapshot is written after every scrape and read from, see snapshot.py. Empty to never use one
+DECK_SNAPSHOT_PATH = os.getenv("DECK_SNAPSHOT_PATH", "decks.snapshot")
+
 # SQL Database Schemas
 SQL_CREATE_CARDS_TABLE = """
                             CREATE TABLE IF NOT EXISTS cards (
@@ -45,7 +104,10 @@ SQL_CREATE_DECKS_TABLE = """
                                 rating integer NOT NULL,
                                 usage integer NOT NULL,
                                 win_rate DECIMAL(4,1) NOT NULL,
-                                entry_date DATE NOT NULL,
+                                entry_time integer NOT NULL,
+                                base_score real NOT NULL,
+                                decay real NOT NULL,
+                                decay_until integer NOT NULL,
                                 FOREIGN KEY (card_1) REFERENCES cards (id),
                                 FOREIGN KEY (card_2) REFERENCES cards (id),
                                 FOREIGN KEY (card_3) REFERENCES cards (id),
@@ -56,26 +118,151 @@ SQL_CREATE_DECKS_TABLE = """
                                 FOREIGN KEY (card_8) REFERENCES cards (id)
                             );
                         """
+SQL_CREATE_DECKS_ENTRY_INDEX = """
+                            CREATE INDEX IF NOT EXISTS decks_entry_time ON decks (entry_time);
+                        """
+SQL_CREATE_DECKS_DECAY_INDEX = """
+                            CREATE INDEX IF NOT EXISTS decks_decay_until ON decks (decay_until);
+                        """
+SQL_CREATE_DECK_COMPATIBILITY_TABLE = """
+                            CREATE TABLE IF NOT EXISTS deck_compatibility (
+                                id text PRIMARY KEY,
+                                slot integer NOT NULL UNIQUE,
+                                compatible blob NOT NULL,
+                                FOREIGN KEY (id) REFERENCES decks (id)
+                            );
+                        """
+
+SQL_CREATE_DECK_CARDS_TABLE = """
+                            CREATE TABLE IF NOT EXISTS deck_cards (
+                                deck_id text NOT NULL,
+                                card_id text NOT NULL,
+                                PRIMARY KEY (deck_id, card_id),
+                                FOREIGN KEY (deck_id) REFERENCES decks (id),
+                                FOREIGN KEY (card_id) REFERENCES cards (id)
+                            ) WITHOUT ROWID;
+                        """
+SQL_CREATE_DECK_CARDS_INDEX = """
+                            CREATE INDEX IF NOT EXISTS deck_cards_card ON deck_cards (card_id, deck_id);
+                        """
+
+SQL_CREATE_METADATA_TABLE = """
+                            CREATE TABLE IF NOT EXISTS metadata (
+                                key text PRIMARY KEY,
+                                value integer NOT NULL
+                            );
+                        """
+SQL_CREATE_LEVELS_TABLE = """
+                            CREATE TABLE IF NOT EXISTS player_levels (
+                                player_tag text NOT NULL,
+                                card_id text NOT NULL,
+                                level integer NOT NULL,
+                                PRIMARY KEY (player_tag, card_id),
+                                FOREIGN KEY (card_id) REFERENCES cards (id)
+                            ) WITHOUT ROWID;
+                        """
+SQL_CREATE_LEVELS_UPDATED_TABLE = """
+                            CREATE TABLE IF NOT EXISTS levels_updated (
+                                id text PRIMARY KEY,
+                                updated real NOT NULL
+                            );
+                        """
+
+SQL_INSERT_DECK = """
+                    INSERT OR REPLACE INTO decks(id, card_1, card_2, card_3, card_4, card_5, card_6,
+                        card_7, card_8, rating, usage, win_rate, entry_time, base_score, decay, decay_until)
+                    VALUES(?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11, ?12, ?13,
+                        112 + ?11 / 2000.0 + ?12 / 20.0, 1, 0)
+                  """
+SQL_INSERT_DECK_CARD = "INSERT OR IGNORE INTO deck_cards(deck_id, card_id) SELECT id, ? FROM decks WHERE id=?"
+
+# Sets the age decay of every deck whose decay changed since it was last set, given the current time as ?1
+# A deck loses a tenth of its score for every full day since it was seen, so its decay next changes on the next
+# multiple of a day after its entry time
+SQL_REFRESH_DECK_DECAY = """
+                    UPDATE decks SET decay = 1 - ((?1 - entry_time) / 86400) * 0.1,
+                        decay_until = entry_time + ((?1 - entry_time) / 86400 + 1) * 86400
+                    WHERE decay_until <= ?1
+                  """
+
+# Saves the time the card list was last updated, given as ?1
+SQL_SET_CARDS_UPDATED = "INSERT OR REPLACE INTO metadata(key, value) VALUES('cards_updated', ?1)"
+
+# The version of the database schema, to be increased whenever a table is added or changed so that update_schema
+# brings existing databases up to date again
+SCHEMA_VERSION = 3
 
 # Database connection variable
 conn = None
 
+# HTTP session variable
+session = None
+
+# The vectorized module, or None if NumPy isn't installed, see get_vectorized
+vectorized = None
+vectorized_imported = False
+
+# Map from card names, as the player API gives them, to card ids, see get_card_names
+card_names = None
+
+# The deck index of the latest version of the decks table, see get_deck_index
+deck_index_cache = None
+deck_index_lock = threading.Lock()
+
+# War deck result cache, from search key to (time cached, result), with the most recently used entry last
+result_cache = OrderedDict()
+result_cache_lock = threading.Lock()
+result_cache_stats = {"hits": 0, "misses": 0}
+
 
 # This function creates a connection to the database
 def create_connection():
     global conn
     try:
-        conn = sqlite3.connect(DB_FILE_NAME)
+        conn = open_connection()
     except sqlite3.Error as e:
         print(e)
 
 
-# This function updates the card list in the database
-def update_cards() -> str:
+# This function opens a new connection to the database, set up like the shared one
+# Threads other than the one that created the shared connection open their own with this to write to the database
+def open_connection() -> sqlite3.Connection:
+    connection = sqlite3.connect(DB_FILE_NAME)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=%s" % DB_SYNCHRONOUS)
+    if metrics.METRICS_ENABLED:
+        connection.set_trace_callback(count_query)
+    return connection
+
+
+# This function counts a database query, see create_connection
+def count_query(statement: str):
+    metrics.inc("db_queries_total")
+
+
+# This function records the latency and size of an HTTP response, see get_session
+def record_response(response: "requests.Response", *args, **kwargs):
+    metrics.observe("http_request_seconds", response.elapsed.total_seconds())
+    metrics.inc("http_requests_total", status=response.status_code)
+    metrics.inc("http_response_bytes_total", len(response.content))
+
+
+# This function updates the card list in the database, through the given connection or else the shared one
+# The time of every successful update is saved, so that load_cards knows when the card list is stale
+def update_cards(connection: sqlite3.Connection | None = None) -> str:
+    global card_names
+    connection = conn if connection is None else connection
     try:
-        assert isinstance(conn, sqlite3.Connection)
-        c = conn.cursor()
-        card_json = requests.get("https://royaleapi.github.io/cr-api-data/json/cards.json").json()
+        assert isinstance(connection, sqlite3.Connection)
+        c = connection.cursor()
+        response = http_cache.fetch(get_session(), CARDS_URL, HTTP_TIMEOUT)
+        response.raise_for_status()
+        if not response.modified and c.execute("SELECT EXISTS(SELECT 1 FROM cards)").fetchone()[0]:
+            c.execute(SQL_SET_CARDS_UPDATED, (int(time.time()),))
+            connection.commit()
+            c.close()
+            return "Card list unchanged...\t\t\t\t" + str(datetime.now())
+        card_json = response.json()
         for card in card_json:
             try:
                 c.execute("""
@@ -85,14 +272,41 @@ def update_cards() -> str:
                           (card["key"], card["name"], card["elixir"], card["type"], card["rarity"]))
             except sqlite3.Error as e:
                 pass
-        conn.commit()
+        c.execute(SQL_SET_CARDS_UPDATED, (int(time.time()),))
+        connection.commit()
         c.close()
+        card_names = None
         return "Updated card list...\t\t\t\t" + str(datetime.now())
     except Exception as e:
         print(e)
         return "Could not update card list...\t\t" + str(datetime.now())
 
 
+# This function updates the card list with its own database connection, so that it can run on any thread
+def update_cards_on_thread() -> str:
+    connection = sqlite3.connect(DB_FILE_NAME)
+    try:
+        return update_cards(connection)
+    finally:
+        connection.close()
+
+
+# This function fills in the card list from the cards table, which is the local copy of the card list
+# The card list is only fetched before returning if the cards table is empty. If it is just older than CARDS_MAX_AGE,
+# it is updated on a background thread, which is returned, so that starting up never waits on the network
+def load_cards() -> threading.Thread | None:
+    assert isinstance(conn, sqlite3.Connection)
+    if not conn.execute("SELECT EXISTS(SELECT 1 FROM cards)").fetchone()[0]:
+        update_cards()
+        return None
+    row = conn.execute("SELECT value FROM metadata WHERE key='cards_updated'").fetchone()
+    if row is not None and time.time() - row[0] < CARDS_MAX_AGE:
+        return None
+    thread = threading.Thread(target=update_cards_on_thread, name="update-cards", daemon=True)
+    thread.start()
+    return thread
+
+
 # Create a table if it does not already exist
 def create_table(table_creation_sql: str):
     if isinstance(conn, sqlite3.Connection):
@@ -102,43 +316,482 @@ def create_table(table_creation_sql: str):
         c.close()
 
 
-# Loads a single RoyaleAPI webpage into the database
-def load_deck(url: str):
-    sql = """
-        INSERT OR REPLACE INTO decks(id, card_1, card_2, card_3, card_4, card_5, card_6,
-            card_7, card_8, rating, usage, win_rate, entry_date)
-        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
+# This function returns the HTTP session shared by every request to RoyaleAPI
+# The session keeps a pool of open connections and retries failed requests with exponential backoff
+def get_session() -> "requests.Session":
+    global session
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
 
-    try:
-        assert isinstance(conn, sqlite3.Connection)
-        c = conn.cursor()
+        retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
         session = requests.Session()
-        response = session.get(url, headers={"user-agent": "Mozilla/5.0"})
-        html = lxml.html.fromstring(response.text)
-
-        for element in html.cssselect(".ui.two.column.stackable.padded.grid"):
-            links = list(element.iterlinks())
-            deck_id = links[0][2][13:]
-            cards = deck_id.split(",")
-            stats = element.xpath("div/div/div/div/table/tbody/tr/*/text()")
-            rating = int(stats[0].strip())
-            usage = int(stats[5].strip().replace(',', ''))
-            win_rate = float(stats[2].strip()[:-1])
+        session.headers["user-agent"] = "Mozilla/5.0"
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if metrics.METRICS_ENABLED:
+            session.hooks["response"].append(record_response)
+    return session
+
+
+# This function imports the vectorized module the first time the numpy engine is used, returning None if NumPy isn't
+# installed
+def get_vectorized():
+    global vectorized, vectorized_imported
+    if not vectorized_imported:
+        vectorized_imported = True
+        try:
+            import vectorized
+        except ImportError:
+            vectorized = None
+    return vectorized
+
+
+# This function inserts deck rows into the decks table in a single transaction
+# The cards of every deck that was written are added to the deck_cards table, and the decay of the new decks and of
+# any deck whose decay changed is set, in the same transaction
+def insert_decks(rows: list, connection: sqlite3.Connection | None = None):
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    c = connection.cursor()
+    try:
+        c.executemany(SQL_INSERT_DECK, rows)
+    except Exception as e:
+        # Fall back to writing the rows one at a time so that one bad row doesn't lose the whole batch
+        print(e)
+        for row in rows:
             try:
-                c.execute(sql, (deck_id, cards[0], cards[1], cards[2], cards[3], cards[4], cards[5], cards[6],
-                                cards[7], rating, usage, win_rate, datetime.now(timezone.utc)))
+                c.execute(SQL_INSERT_DECK, row)
             except Exception as e:
                 print(e)
-                pass
+    c.executemany(SQL_INSERT_DECK_CARD, [(row[i], row[0]) for row in rows for i in range(1, 9)])
+    c.execute(SQL_REFRESH_DECK_DECAY, (int(time.time()),))
+    connection.commit()
+    c.close()
+
+
+# This function writes deck rows to the database and updates everything that depends on the decks table
+# It writes through the given connection or else the shared one, like the functions it calls
+def write_decks(rows: list, connection: sqlite3.Connection | None = None):
+    if len(rows) == 0:
+        return
+    insert_decks(rows, connection)
+    bump_decks_version(connection)
+    update_compatibility_index(connection)
+
+
+# This function marks decks as seen again now, for the decks listed on pages that haven't changed since they were last
+# loaded, so that decks that are still popular don't decay or get purged just because their page wasn't parsed again
+def touch_decks(deck_ids: list, connection: sqlite3.Connection | None = None):
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    if len(deck_ids) == 0:
+        return
+    now = int(time.time())
+    c = connection.cursor()
+    c.executemany("UPDATE decks SET entry_time=?, decay=1, decay_until=0 WHERE id=?",
+                  [(now, deck_id) for deck_id in deck_ids])
+    c.execute(SQL_REFRESH_DECK_DECAY, (now,))
+    connection.commit()
+    c.close()
+    bump_decks_version(connection)
+
+
+# This function deletes the decks older than the given number of days, as range deletes on the entry time index
+def purge_old_decks(days: int = 60, connection: sqlite3.Connection | None = None):
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    cutoff = int(time.time()) - days * 86400
+    c = connection.cursor()
+    c.execute("DELETE FROM deck_cards WHERE deck_id IN (SELECT id FROM decks WHERE entry_time < ?)", (cutoff,))
+    c.execute("DELETE FROM decks WHERE entry_time < ?", (cutoff,))
+    deleted = c.rowcount
+    connection.commit()
+    c.close()
+    if deleted > 0:
+        bump_decks_version(connection)
+        update_compatibility_index(connection)
+        save_deck_snapshot(connection=connection)
+
+
+# This function sets the decay of every deck whose decay changed since it was last set, such as after a day rolls over
+# Only those decks are written, found with a range scan of the decay index. Returns the number of decks updated
+def refresh_deck_scores() -> int:
+    assert isinstance(conn, sqlite3.Connection)
+    c = conn.cursor()
+    c.execute(SQL_REFRESH_DECK_DECAY, (int(time.time()),))
+    updated = c.rowcount
+    conn.commit()
+    c.close()
+    return updated
+
 
+# Create the decks table and its indexes if necessary, moving the decks out of the old table with text entry dates
+# if it exists
+# The decks are copied into a new table since SQLite can't change the columns in place
+def update_decks_table():
+    assert isinstance(conn, sqlite3.Connection)
+    c = conn.cursor()
+    columns = [row[1] for row in c.execute("PRAGMA table_info(decks)").fetchall()]
+    if "entry_date" in columns:
+        rows = [(*row[:12], int(datetime.fromisoformat(row[12]).timestamp())) for row in
+                c.execute("SELECT id, card_1, card_2, card_3, card_4, card_5, card_6, card_7, card_8, rating, usage, "
+                          "win_rate, entry_date FROM decks")]
+        c.execute(SQL_CREATE_DECKS_TABLE.replace("decks (", "decks_new (", 1))
+        c.executemany(SQL_INSERT_DECK.replace("INTO decks(", "INTO decks_new(", 1), rows)
+        c.execute("DROP TABLE decks")
+        c.execute("ALTER TABLE decks_new RENAME TO decks")
         conn.commit()
+    c.close()
+    create_table(SQL_CREATE_DECKS_TABLE)
+    create_table(SQL_CREATE_DECKS_ENTRY_INDEX)
+    create_table(SQL_CREATE_DECKS_DECAY_INDEX)
+    refresh_deck_scores()
+
+
+# This function creates every table and index and brings the tables of older versions up to date
+# Once a database is at SCHEMA_VERSION this is skipped, so that starting up doesn't read every deck each time. The
+# tables that depend on the decks table are kept in sync by write_decks from then on.
+def update_schema():
+    assert isinstance(conn, sqlite3.Connection)
+    create_table(SQL_CREATE_METADATA_TABLE)
+    row = conn.execute("SELECT value FROM metadata WHERE key='schema_version'").fetchone()
+    if row is not None and row[0] >= SCHEMA_VERSION:
+        return
+    create_table(SQL_CREATE_CARDS_TABLE)
+    update_decks_table()
+    update_deck_cards_table()
+    create_table(SQL_CREATE_DECK_COMPATIBILITY_TABLE)
+    update_compatibility_index()
+    update_levels_table()
+    create_table(SQL_CREATE_LEVELS_UPDATED_TABLE)
+    conn.execute("INSERT OR REPLACE INTO metadata(key, value) VALUES('schema_version', ?)", (SCHEMA_VERSION,))
+    conn.commit()
+
+
+# Create the deck_cards table and its card index if necessary, and add the cards of any decks that aren't in it yet
+def update_deck_cards_table():
+    assert isinstance(conn, sqlite3.Connection)
+    create_table(SQL_CREATE_DECK_CARDS_TABLE)
+    create_table(SQL_CREATE_DECK_CARDS_INDEX)
+    conn.execute("INSERT OR IGNORE INTO deck_cards(deck_id, card_id) %s" % " UNION ALL ".join(
+        "SELECT id, card_%d FROM decks WHERE id NOT IN (SELECT deck_id FROM deck_cards)" % i for i in range(1, 9)))
+    conn.commit()
+
+
+# This function gets the version of the decks table, which changes every time decks are written or deleted
+# It reads through the given connection or else the shared one, like the other functions the deck index is loaded with
+def get_decks_version(connection: sqlite3.Connection | None = None) -> int:
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    row = connection.execute("SELECT value FROM metadata WHERE key='decks_version'").fetchone()
+    return 0 if row is None else row[0]
+
+
+# This function marks the decks table as changed, so that cached war deck results are no longer used
+def bump_decks_version(connection: sqlite3.Connection | None = None):
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    connection.execute("INSERT INTO metadata(key, value) VALUES('decks_version', 1) "
+                       "ON CONFLICT(key) DO UPDATE SET value=value + 1")
+    connection.commit()
+
+
+# Loads a single RoyaleAPI webpage into the database
+def load_deck(url: str):
+    try:
+        with metrics.timer("load_deck_seconds"):
+            response = http_cache.fetch(get_session(), url, HTTP_TIMEOUT)
+            response.raise_for_status()
+            if not response.modified and "deck_ids" in response.data:
+                touch_decks(response.data["deck_ids"])
+            else:
+                import extract
+                rows = extract.parse_deck_page(response.text)
+                http_cache.save_data(url, {"deck_ids": [row[0] for row in rows]})
+                write_decks(rows)
+                metrics.inc("decks_loaded_total", len(rows))
+            save_deck_snapshot()
     except Exception as e:
         print(e)
         print("Could not load decks...\n")
         return
 
 
+# This function gets the RoyaleAPI popular decks page for a card, or for all cards if card is None
+def popular_decks_url(card: str | None = None) -> str:
+    url = ROYALEAPI_URL + "/decks/popular?type=GC&time=7d&size=20"
+    return url if card is None else url + "&inc=" + card
+
+
+# This function keeps the deck compatibility index in sync with the decks table
+# Every deck is given a fixed slot, and its row holds a bitset of the slots of the decks it shares no card with
+# Only the rows of new decks and of the decks whose bitsets changed are written
+def update_compatibility_index(connection: sqlite3.Connection | None = None):
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    c = connection.cursor()
+
+    # The index takes the square of the number of decks in bits, so it is dropped for very large deck tables
+    if c.execute("SELECT COUNT(*) FROM decks").fetchone()[0] > COMPATIBILITY_INDEX_MAX_DECKS:
+        c.execute("DELETE FROM deck_compatibility")
+        connection.commit()
+        c.close()
+        return
+
+    index = {row[0]: (row[1], int.from_bytes(row[2], "little"))
+             for row in c.execute("SELECT id, slot, compatible FROM deck_compatibility")}
+    decks = {row[0]: row[1:] for row in c.execute("SELECT id, card_1, card_2, card_3, card_4, card_5, card_6, "
+                                                  "card_7, card_8 FROM decks")}
+
+    # Free the slots of the decks that aged out
+    removed = [deck_id for deck_id in index if deck_id not in decks]
+    removed_slots = 0
+    for deck_id in removed:
+        removed_slots |= 1 << index.pop(deck_id)[0]
+
+    # New decks take the lowest free slots
+    added = {}
+    taken = {slot for slot, _ in index.values()}
+    slot = 0
+    for deck_id in sorted(deck_id for deck_id in decks if deck_id not in index):
+        while slot in taken:
+            slot += 1
+        added[deck_id] = slot
+        taken.add(slot)
+    if len(removed) == 0 and len(added) == 0:
+        c.close()
+        return
+
+    # Get the slots of the decks that contain each card, for all decks and for the new decks only
+    card_slots = {}
+    new_card_slots = {}
+    all_slots = 0
+    new_slots = 0
+    for deck_id, slot in [(deck_id, entry[0]) for deck_id, entry in index.items()] + list(added.items()):
+        all_slots |= 1 << slot
+        for card in decks[deck_id]:
+            card_slots[card] = card_slots.get(card, 0) | 1 << slot
+        if deck_id in added:
+            new_slots |= 1 << slot
+            for card in decks[deck_id]:
+                new_card_slots[card] = new_card_slots.get(card, 0) | 1 << slot
+
+    rows = []
+    for deck_id, (slot, compatible) in index.items():
+        blocked = 0
+        for card in decks[deck_id]:
+            blocked |= new_card_slots.get(card, 0)
+        updated = compatible & ~removed_slots | new_slots & ~blocked
+        if updated != compatible:
+            rows.append((deck_id, slot, updated.to_bytes((updated.bit_length() + 7) // 8, "little")))
+    for deck_id, slot in added.items():
+        blocked = 0
+        for card in decks[deck_id]:
+            blocked |= card_slots[card]
+        compatible = all_slots & ~blocked
+        rows.append((deck_id, slot, compatible.to_bytes((compatible.bit_length() + 7) // 8, "little")))
+
+    c.executemany("DELETE FROM deck_compatibility WHERE id=?", [(deck_id,) for deck_id in removed])
+    c.executemany("INSERT OR REPLACE INTO deck_compatibility(id, slot, compatible) VALUES(?, ?, ?)", rows)
+    connection.commit()
+    c.close()
+
+
+# This function loads the deck compatibility index as a dictionary from deck id to (slot, compatible bitset)
+def load_compatibility_index(connection: sqlite3.Connection | None = None) -> dict:
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    return {row[0]: (row[1], int.from_bytes(row[2], "little"))
+            for row in connection.execute("SELECT id, slot, compatible FROM deck_compatibility")}
+
+
+# Every deck with everything about it that is the same for every player, loaded once to search for many players
+# See load_deck_index
+@dataclass
+class DeckIndex:
+    decks: list  # Every deck row, or the deck snapshot, in the order of the decks table
+    card_index: dict  # The bit position of every card
+    masks: dict  # The card bitmask of each deck id, in the order of the decks
+    compatibility: dict | None  # The compatibility index, or None if it doesn't cover every deck
+    version: int  # The version of the decks table the index was loaded from
+    matrix: object = None  # The decks as a vectorized.DeckMatrix for the numpy engine, or None
+    ids: list = field(init=False)  # The deck ids, in the order of the decks
+    positions: dict = field(init=False)  # The position of each deck id
+    card_decks: dict = field(init=False)  # The decks with each card read from deck_cards so far, see get_card_decks
+
+    def __post_init__(self):
+        self.ids = list(self.masks)
+        self.positions = {deck_id: pos for pos, deck_id in enumerate(self.ids)}
+        self.card_decks = {}
+
+
+# The decks of a deck index that a player can use, see get_candidate_decks
+# They work as a sequence of deck rows, but only the positions of the decks in the index are kept. Rows are only made
+# for the decks that are read, and score_deck_table reads the decks of a deck snapshot straight from its arrays.
+class CandidateDecks(Sequence):
+    def __init__(self, index: DeckIndex, positions: array):
+        self.index = index
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+        return self.index.decks[self.positions[pos]]
+
+
+# This function gets the ids of a list of decks, without making the rows of candidate decks
+def get_deck_ids(decks) -> list:
+    if isinstance(decks, CandidateDecks):
+        ids = decks.index.ids
+        return [ids[pos] for pos in decks.positions]
+    return [deck[0] for deck in decks]
+
+
+# This function gets the decks of a deck index that have a card, from the card index of the deck_cards table
+# They are kept as an int with a byte for each position of the index, 1 if the deck there has the card, so that the
+# decks with any of several cards are found with a bitwise or. Each card is only read once for each deck index.
+def get_card_decks(index: DeckIndex, card: str, connection: sqlite3.Connection) -> int:
+    card_decks = index.card_decks.get(card)
+    if card_decks is None:
+        marks = bytearray(len(index.ids))
+        positions = index.positions
+        for (deck_id,) in connection.execute("SELECT deck_id FROM deck_cards WHERE card_id = ?", (card,)):
+            pos = positions.get(deck_id)
+            if pos is not None:
+                marks[pos] = 1
+        card_decks = index.card_decks[card] = int.from_bytes(marks, "little")
+    return card_decks
+
+
+# This function gets the decks of a deck index that a player can use, leaving out every deck with a card that the
+# player doesn't have or that is excluded. The anti-join is done on the deck_cards table, whose card index gives the
+# decks with each of those cards, and every other deck of the index is a candidate
+def get_candidate_decks(index: DeckIndex, levels: dict, exclude_set: set,
+                        connection: sqlite3.Connection | None = None) -> CandidateDecks:
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    excluded = 0
+    for card in index.card_index:
+        if levels.get(card) is None or card in exclude_set:
+            excluded |= get_card_decks(index, card, connection)
+    size = len(index.ids)
+    usable = (int.from_bytes(b"\1" * size, "little") ^ excluded).to_bytes(size, "little")
+    return CandidateDecks(index, array("I", compress(range(size), usable)))
+
+
+# This function writes the deck snapshot, from the given deck rows or else from the decks table
+# Decks are written in the order of the decks table, which is the order the search goes through them in
+def save_deck_snapshot(decks: list | None = None, version: int | None = None,
+                       connection: sqlite3.Connection | None = None):
+    if DECK_SNAPSHOT_PATH == "":
+        return
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    try:
+        if decks is None:
+            decks = connection.execute("SELECT * FROM decks").fetchall()
+        snapshot.write_snapshot(DECK_SNAPSHOT_PATH, decks, get_card_index(decks, connection),
+                                get_decks_version(connection) if version is None else version)
+    except (OSError, sqlite3.Error, snapshot.SnapshotError) as e:
+        print(e)
+        print("Could not write the deck snapshot...")
+
+
+# This function maps the deck snapshot, at path or else DECK_SNAPSHOT_PATH, returning None if there is none or if it
+# isn't of the given version of the decks table
+def load_deck_snapshot(version: int, path: str | None = None) -> snapshot.DeckSnapshot | None:
+    path = DECK_SNAPSHOT_PATH if path is None else path
+    if path == "" or not os.path.exists(path) or sys.byteorder != "little":
+        return None
+    try:
+        deck_snapshot = snapshot.DeckSnapshot(path)
+    except (OSError, ValueError, snapshot.SnapshotError) as e:
+        print(e)
+        print("Could not read the deck snapshot...")
+        return None
+    if deck_snapshot.version != version:
+        deck_snapshot.close()
+        return None
+    return deck_snapshot
+
+
+# This function loads every deck into a deck index, with a deck matrix if the numpy engine is used
+# Decks are read from the deck snapshot when it is up to date, so that they are shared with every other process that
+# maps it and rows are only made for the decks a player can use. Otherwise they are read from the decks table, and the
+# snapshot is written for the next time.
+def load_deck_index(engine: str = SEARCH_ENGINE, connection: sqlite3.Connection | None = None) -> DeckIndex:
+    connection = conn if connection is None else connection
+    assert isinstance(connection, sqlite3.Connection)
+    version = get_decks_version(connection)
+    decks = load_deck_snapshot(version)
+    if decks is None:
+        decks = connection.execute("SELECT * FROM decks").fetchall()
+        ids = [deck[0] for deck in decks]
+    else:
+        ids = [decks.deck_id(pos) for pos in range(len(decks))]
+
+    compatibility = load_compatibility_index(connection)
+    if len(compatibility) == 0 or not all(deck_id in compatibility for deck_id in ids):
+        compatibility = None
+
+    matrix = None
+    if isinstance(decks, snapshot.DeckSnapshot):
+        # The card indices of the snapshot are kept as bit positions, with any cards added since after them
+        card_index = {card: idx for idx, card in enumerate(decks.card_ids)}
+        for card in get_card_index([], connection):
+            card_index.setdefault(card, len(card_index))
+        masks = {deck_id: decks.card_mask(pos) for pos, deck_id in enumerate(ids)}
+        if engine == "numpy" and get_vectorized() is not None:
+            matrix = vectorized.load_snapshot_matrix(decks, ids, len(card_index))
+    else:
+        save_deck_snapshot(decks, version, connection)
+        card_index = get_card_index(decks, connection)
+        masks = {deck[0]: card_mask(deck[1:9], card_index) for deck in decks}
+        if engine == "numpy" and get_vectorized() is not None:
+            matrix = vectorized.load_deck_matrix(decks, card_index)
+    return DeckIndex(decks, card_index, masks, compatibility, version, matrix)
+
+
+# This function gets the deck index of the current version of the decks table, loading it again only after the decks
+# table changes, so that every request in a process shares it
+# It can be called from any thread with that thread's own connection, and the index is only loaded by one at a time
+def get_deck_index(engine: str = SEARCH_ENGINE, connection: sqlite3.Connection | None = None) -> DeckIndex:
+    global deck_index_cache
+    with deck_index_lock:
+        if deck_index_cache is None or deck_index_cache.version != get_decks_version(connection) or \
+                engine == "numpy" and get_vectorized() is not None and deck_index_cache.matrix is None:
+            deck_index_cache = load_deck_index(engine, connection)
+        return deck_index_cache
+
+
+# This function gets the deck index with its own database connection, so that it can run on any thread
+def get_deck_index_on_thread(engine: str = SEARCH_ENGINE) -> DeckIndex:
+    connection = sqlite3.connect(DB_FILE_NAME)
+    try:
+        return get_deck_index(engine, connection)
+    finally:
+        connection.close()
+
+
+# This function gets the deck index with the decks of it that a player can use, with its own database connection, so
+# that it can run on any thread
+def get_candidate_decks_on_thread(levels: dict, exclude_set: set,
+                                  engine: str = SEARCH_ENGINE) -> (DeckIndex, CandidateDecks):
+    connection = sqlite3.connect(DB_FILE_NAME)
+    try:
+        index = get_deck_index(engine, connection)
+        return index, get_candidate_decks(index, levels, exclude_set, connection)
+    finally:
+        connection.close()
+
+
 # Load the player's levels in for better war deck advice
 def load_levels(tag: str) -> str:
     if len(tag) == 0:
@@ -148,8 +801,8 @@ def load_levels(tag: str) -> str:
         tag = tag[1:]
     tag = tag.upper()
 
-    url = "https://proxy.royaleapi.dev/v1/players/%23" + tag
-    player_info = requests.get(url, headers={"Authorization": "Bearer " + CR_API_TOKEN}).json()
+    with metrics.timer("load_levels_seconds", stage="fetch"):
+        player_info = get_session().get(player_url(tag), headers=player_api_headers(), timeout=HTTP_TIMEOUT).json()
     tag = "#" + tag
 
     if "reason" in player_info:
@@ -157,34 +810,100 @@ def load_levels(tag: str) -> str:
     else:
         if not isinstance(conn, sqlite3.Connection):
             return "Could not connect to database."
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO levels(id) VALUES(?)", (tag,))
-        for card in player_info["cards"]:
-            card_name = card["name"].lower().replace(" ", "_").replace(".", "").replace("-", "_")
-            if c.execute("SELECT EXISTS(SELECT 1 FROM cards WHERE id='%s')" %
-                         card_name.replace("_", "-")).fetchone()[0] == 0:
-                print("Found unknown card %s. Please report to developer." % card_name)
-            c.execute("UPDATE levels SET %s=? WHERE id=?" % card_name, (14 - card["maxLevel"] + card["level"], tag))
-        conn.commit()
-        c.close()
+        levels = player_levels_from_cards(player_info["cards"], get_card_names())
+        with metrics.timer("load_levels_seconds", stage="save"):
+            save_levels(tag, levels)
         return "Levels for player " + player_info["name"] + " successfully loaded."
 
 
-# Create and update the levels table if necessary
-# Columns use underscores instead of dashes due to SQL column naming rules
+# This function gets the player API URL of a player, given their tag with or without the #
+def player_url(tag: str) -> str:
+    return PLAYER_API_URL + "/players/%23" + tag.lstrip("#").upper()
+
+
+# This function gets the headers sent with every request to the player API
+def player_api_headers() -> dict:
+    return {"Authorization": "Bearer %s" % CR_API_TOKEN}
+
+
+# This function gets the map from card names, as the player API gives them, to card ids
+# It is built from the cards table the first time it is needed, and again after the card list changes
+def get_card_names() -> dict:
+    global card_names
+    if card_names is None:
+        assert isinstance(conn, sqlite3.Connection)
+        card_names = dict(conn.execute("SELECT name, id FROM cards").fetchall())
+    return card_names
+
+
+# This function converts a player's cards from the player API into a dictionary from card id to level
+# A name that isn't in the map is turned into an id from the name itself and added to the map, so that it's only
+# reported once
+def player_levels_from_cards(cards: list, names: dict) -> dict:
+    levels = {}
+    for card in cards:
+        card_id = names.get(card["name"])
+        if card_id is None:
+            card_id = card["name"].lower().replace(" ", "-").replace(".", "")
+            print("Found unknown card %s. Please report to developer." % card_id)
+            names[card["name"]] = card_id
+        levels[card_id] = 14 - card["maxLevel"] + card["level"]
+    return levels
+
+
+# This function saves a player's levels, given as a dictionary from card id to level, to the levels table
+# The player's old levels are replaced in a single transaction
+def save_levels(tag: str, levels: dict):
+    save_many_levels({tag: levels})
+
+
+# This function saves the levels of many players, given as a dictionary from player tag to levels, to the levels table
+# The old levels of every player are replaced in a single transaction
+def save_many_levels(players: dict):
+    assert isinstance(conn, sqlite3.Connection)
+    updated = time.time()
+    c = conn.cursor()
+    c.executemany("DELETE FROM player_levels WHERE player_tag=?", [(tag,) for tag in players])
+    c.executemany("INSERT INTO player_levels(player_tag, card_id, level) VALUES(?, ?, ?)",
+                  [(tag, card, level) for tag, levels in players.items() for card, level in levels.items()
+                   if level is not None])
+    c.executemany("INSERT OR REPLACE INTO levels_updated(id, updated) VALUES(?, ?)",
+                  [(tag, updated) for tag in players])
+    conn.commit()
+    c.close()
+
+
+# This function gets a player's levels as a dictionary from card id to level
+# Returns None if the player's levels were never saved
+def get_player_levels(tag: str) -> dict | None:
+    assert isinstance(conn, sqlite3.Connection)
+    levels = dict(conn.execute("SELECT card_id, level FROM player_levels WHERE player_tag=?", (tag,)).fetchall())
+    return levels if len(levels) > 0 else None
+
+
+# This function gets a player's saved levels as a dictionary from card id to level
+# Returns None if the player's levels were never saved, or were saved more than max_age seconds ago
+def get_saved_levels(tag: str, max_age: float) -> dict | None:
+    assert isinstance(conn, sqlite3.Connection)
+    updated = conn.execute("SELECT updated FROM levels_updated WHERE id=?", (tag,)).fetchone()
+    if updated is None or time.time() - updated[0] >= max_age:
+        return None
+    return get_player_levels(tag)
+
+
+# Create the levels table if necessary, moving the levels out of the old table with a column per card if it exists
+# Levels are stored one row per player and card, so new cards don't change the schema
 def update_levels_table():
     assert (isinstance(conn, sqlite3.Connection))
-    sql_create_levels_table = "CREATE TABLE IF NOT EXISTS levels (\n\tid text PRIMARY KEY,\n\t"
+    create_table(SQL_CREATE_LEVELS_TABLE)
     c = conn.cursor()
-    for row in c.execute("SELECT * FROM cards"):
-        sql_create_levels_table += row[0].replace("-", "_") + " integer,\n\t"
-    sql_create_levels_table = sql_create_levels_table[:-3]
-    sql_create_levels_table += "\n);"
-    create_table(sql_create_levels_table)
-    columns = [(row[1]) for row in c.execute("PRAGMA table_info(levels)").fetchall()]
-    for row in c.execute("SELECT * FROM cards"):
-        if row[0].replace("-", "_") not in columns:
-            c.execute("ALTER TABLE levels ADD COLUMN %s integer" % row[0].replace("-", "_"))
+    columns = [row[1] for row in c.execute("PRAGMA table_info(levels)").fetchall()]
+    if len(columns) > 0:
+        # Old columns use underscores instead of dashes due to SQL column naming rules
+        for column in columns[1:]:
+            c.execute("INSERT OR REPLACE INTO player_levels(player_tag, card_id, level) SELECT id, ?, %s FROM levels "
+                      "WHERE %s IS NOT NULL" % (column, column), (column.replace("_", "-"),))
+        c.execute("DROP TABLE levels")
     conn.commit()
     c.close()
 
@@ -206,42 +925,443 @@ def validate_card_list(card_list: str) -> (bool, set):
     return is_valid, set(cards)
 
 
+# This function builds a fixed bit position for every card so that card sets can be stored as integer bitmasks
+# Cards that appear in the decks but not yet in the cards table are given positions after the known cards
+def get_card_index(decks: list, connection: sqlite3.Connection | None = None) -> dict:
+    connection = conn if connection is None else connection
+    card_index = {}
+    if isinstance(connection, sqlite3.Connection):
+        for row in connection.execute("SELECT id FROM cards ORDER BY id"):
+            card_index[row[0]] = len(card_index)
+    for deck in decks:
+        for i in range(1, 9):
+            if deck[i] not in card_index:
+                card_index[deck[i]] = len(card_index)
+    return card_index
+
+
+# This function converts a player's levels into a vector over the card index
+# Cards the player doesn't have are 0, which is never a real level
+def level_vector(levels: dict, card_index: dict) -> array:
+    vector = array("B", bytes(len(card_index)))
+    for card, level in levels.items():
+        if level is not None and card in card_index:
+            vector[card_index[card]] = level
+    return vector
+
+
+# This function converts a collection of card ids into a bitmask over the card index
+def card_mask(cards, card_index: dict) -> int:
+    mask = 0
+    for card in cards:
+        if card not in card_index:
+            card_index[card] = len(card_index)
+        mask |= 1 << card_index[card]
+    return mask
+
+
+# The per-request view of the deck list that the search works from
+# Every field is indexed by the position of the deck in the deck list that was passed in, so that the search goes
+# through the decks in the same order with or without the compatibility index, whose bitsets are over deck slots
+@dataclass
+class DeckTable:
+    ids: list  # The deck ids, which are also the comma-separated card lists
+    masks: list  # The card bitmask of each deck
+    scores: array  # The score of each deck for the requesting player
+    feasible: bytearray  # 1 if the player has every card of the deck and none of them are excluded, 0 otherwise
+    compatible: list  # The slot bitset of the decks that share no card with each deck, empty without the index
+    positions: dict  # The position of each deck id
+    slot_positions: dict = field(default_factory=dict)  # The position of the deck in each slot, with the index
+    feasible_slots: int = 0  # The slot bitset of the feasible decks, with the index
+    include_mask: int = 0  # The card bitmask of the required cards
+    required: dict = field(default_factory=dict)  # The feasible decks with each required card, see add_required_cards
+
+
 # This function computes the score of a deck, or how good it is
-# Modifying how the score is computing will affect which decks get returned
-def deck_score(decks, levels: dict, prev_score: int, used: set, prev_decks: [], max_idx: int, exclude_set: set):
-    for cur_idx in range(max_idx + 1, len(decks)):
-        deck = decks[cur_idx]
-        can_add = True  # Initial value of can_add
-        levels_off_max = 0  # Number of levels off of having the war deck maxed
+# Modifying how the score is computing will affect which decks get returned, along with SQL_INSERT_DECK and
+# SQL_REFRESH_DECK_DECAY, which keep the parts of the score that are the same for every player in the decks table
+# The stored decay is only used until it changes, so that a missed refresh never gives a wrong score
+def static_deck_score(base_score: float, decay: float, decay_until: int, entry_time: int, levels_off_max: int,
+                      now: int) -> float:
+    score = base_score - levels_off_max
+    score *= decay if now < decay_until else 1 - (now - entry_time) // 86400 * 0.1
+    score *= 2
+    return score
 
-        for i in range(1, 9):
-            if deck[i] in used or deck[i] in exclude_set:
-                # If we already used a card, we can't use this deck
-                can_add = False
-                break
 
-            # Get the card level, if it exists
-            level = levels.get(deck[i])
+# This function precomputes everything about the decks that stays fixed for a whole request
+# None of the deck scores depend on the other decks in a set, so each one is computed exactly once here
+# masks can give the card bitmask of each deck id, so that they aren't worked out again
+def build_deck_table(decks: Sequence, levels: dict, exclude_set: set, card_index: dict,
+                     compatibility: dict | None = None, masks: dict | None = None) -> DeckTable:
+    exclude_mask = card_mask(exclude_set, card_index)
+    return score_deck_table(decks, level_vector(levels, card_index), exclude_mask, card_index, compatibility, masks)
 
-            if level is None:
-                # If the player doesn't have this card, we also can't use this deck
-                can_add = False
-                break
-            else:
-                levels_off_max += 14 - level
-        if not can_add:
-            score = -1000000000
+
+# This function is build_deck_table with the player's levels as a level vector and the excluded cards as a bitmask
+def score_deck_table(decks: Sequence, level_of: array, exclude_mask: int, card_index: dict,
+                     compatibility: dict | None = None, masks: dict | None = None) -> DeckTable:
+    now = int(time.time())
+    size = len(decks)
+    table = DeckTable(get_deck_ids(decks), [0] * size, array("d", bytes(8 * size)), bytearray(size),
+                      [0] * size if compatibility is not None else [], {})
+
+    # Candidate decks are read from the rows of their deck index, and those of a deck snapshot from its arrays
+    if isinstance(decks, CandidateDecks):
+        rows, row_positions = decks.index.decks, decks.positions
+    else:
+        rows, row_positions = decks, range(size)
+    deck_snapshot = rows if isinstance(rows, snapshot.DeckSnapshot) else None
+    if deck_snapshot is not None:
+        # The card indices of every deck are turned into the number of levels each card is off max in one pass, so
+        # that the levels a deck is off max are the sum of its 8 bytes
+        levels_off = bytes(deck_snapshot.cards).translate(bytes(14 - level if level else 0 for level in level_of[:256])
+                                                          .ljust(256, b"\0"))
+        base_scores, entry_times = deck_snapshot.base_scores(), deck_snapshot.entry_times
+
+    # A deck can't be used if it has an excluded card, a card the player doesn't have, or a card the level vector
+    # doesn't cover, so this is checked against a single mask before any card levels are looked at
+    unusable = exclude_mask | ~((1 << len(level_of)) - 1)
+    for idx, level in enumerate(level_of):
+        if level == 0:
+            unusable |= 1 << idx
+
+    for pos, (deck_id, row) in enumerate(zip(table.ids, row_positions)):
+        slot = None
+        if compatibility is not None:
+            slot, table.compatible[pos] = compatibility[deck_id]
+            table.slot_positions[slot] = pos
+
+        mask = card_mask(rows[row][1:9], card_index) if masks is None else masks[deck_id]
+        table.masks[pos] = mask
+        table.positions[deck_id] = pos
+        if mask & unusable:
+            continue
+
+        if deck_snapshot is None:
+            deck = rows[row]
+            levels_off_max = 0  # Number of levels off of having the war deck maxed
+            for i in range(1, 9):
+                levels_off_max += 14 - level_of[card_index[deck[i]]]
+            table.scores[pos] = static_deck_score(deck[13], deck[14], deck[15], deck[12], levels_off_max, now)
         else:
-            score = 112 - levels_off_max + deck[10] / 2000 + deck[11] / 20
-            score *= 1 - (datetime.now(timezone.utc) - datetime.strptime(deck[12], "%Y-%m-%d %H:%M:%S.%f%z")).days * 0.1
-            score *= 2
+            table.scores[pos] = static_deck_score(base_scores[row], 1.0, 0, entry_times[row],
+                                                  sum(levels_off[row * 8:row * 8 + 8]), now)
+        table.feasible[pos] = 1
+        if slot is not None:
+            table.feasible_slots |= 1 << slot
+    return table
+
+
+# This function yields every deck that can extend a set of decks, along with the resulting set
+# Only decks after max_idx are considered so that every set is generated exactly once
+def deck_score(table: DeckTable, prev_score: float, used: int, prev_decks: [], max_idx: int):
+    if table.compatible:
+        yield from compatible_deck_score(table, prev_score, used, prev_decks, max_idx)
+        return
+
+    masks = table.masks
+    scores = table.scores
+    feasible = table.feasible
+    for cur_idx in range(max_idx + 1, len(masks)):
+        # If the deck is infeasible or we already used one of its cards, we can't use this deck
+        if not feasible[cur_idx] or masks[cur_idx] & used:
+            continue
 
         new_decks = list(prev_decks)
-        new_decks.append(deck[0])
-        new_used = copy.deepcopy(used)
-        for i in range(1, 9):
-            new_used.add(deck[i])
-        yield prev_score + score, new_used, new_decks, cur_idx
+        new_decks.append(table.ids[cur_idx])
+        yield prev_score + scores[cur_idx], used | masks[cur_idx], new_decks, cur_idx
+
+
+# This function is deck_score for a table built with the compatibility index
+# The decks that can be added are the feasible decks compatible with every deck in the set, so they are found by
+# intersecting slot bitsets instead of checking the cards of every later deck. The slots are then turned back into
+# positions, so that decks are yielded in the same order as deck_score
+def compatible_deck_score(table: DeckTable, prev_score: float, used: int, prev_decks: [], max_idx: int):
+    candidates = table.feasible_slots
+    for deck_id in prev_decks:
+        candidates &= table.compatible[table.positions[deck_id]]
+
+    slot_positions = table.slot_positions
+    bits = bin(candidates)[:1:-1]  # Lowest bit first
+    cur_positions = []
+    slot = bits.find("1")
+    while slot != -1:
+        if slot_positions[slot] > max_idx:
+            cur_positions.append(slot_positions[slot])
+        slot = bits.find("1", slot + 1)
+    cur_positions.sort()
+
+    masks = table.masks
+    scores = table.scores
+    for cur_idx in cur_positions:
+        new_decks = list(prev_decks)
+        new_decks.append(table.ids[cur_idx])
+        yield prev_score + scores[cur_idx], used | masks[cur_idx], new_decks, cur_idx
+
+
+# This function finds the feasible decks with each required card, from the card bit to the positions of the decks
+# The positions are sorted from the best deck to the worst
+def add_required_cards(table: DeckTable, include_mask: int):
+    table.include_mask = include_mask
+    table.required = {bit: [] for bit in range(include_mask.bit_length()) if include_mask >> bit & 1}
+    for pos, mask in enumerate(table.masks):
+        if table.feasible[pos] and mask & include_mask:
+            for bit, positions in table.required.items():
+                if mask >> bit & 1:
+                    positions.append(pos)
+    for positions in table.required.values():
+        positions.sort(key=lambda pos: -table.scores[pos])
+
+
+# This function checks whether the remaining slots of a set can still be filled so that it has every required card
+# Every missing card needs a deck that fits in the set, and with one slot left, a single deck needs all of them
+def can_cover(table: DeckTable, missing: int, used: int, remaining: int) -> bool:
+    if missing == 0:
+        return True
+    if remaining == 0:
+        return False
+    masks = table.masks
+    for bit, positions in table.required.items():
+        if missing >> bit & 1:
+            if remaining == 1:
+                return any(masks[pos] & missing == missing and not masks[pos] & used for pos in positions)
+            if all(masks[pos] & used for pos in positions):
+                return False
+    return True
+
+
+# This function yields the decks that can extend a set that is still missing required cards, best first
+# The next deck must have the hardest missing card, the one in the fewest decks. The decks of a set share no cards, so
+# every set with all the required cards has exactly one such deck and is still generated once. Once the set has every
+# required card, the rest of its decks are added by deck_score from the first position, which is why -1 is yielded as
+# the last position.
+def required_deck_score(table: DeckTable, prev_score: float, used: int, prev_decks: [], remaining: int):
+    missing = table.include_mask & ~used
+    hardest = min((bit for bit in table.required if missing >> bit & 1), key=lambda bit: len(table.required[bit]))
+    masks = table.masks
+    for pos in table.required[hardest]:
+        if masks[pos] & used or not can_cover(table, missing & ~masks[pos], used | masks[pos], remaining - 1):
+            continue
+
+        new_decks = list(prev_decks)
+        new_decks.append(table.ids[pos])
+        yield prev_score + table.scores[pos], used | masks[pos], new_decks, -1
+
+
+# Raised when a search is cancelled before it finishes
+class SearchCancelled(Exception):
+    pass
+
+
+# This class is a cancel event that is also set once a time budget runs out, so that a search given one stops at its
+# deadline the same way it stops when it is cancelled
+class Deadline:
+    def __init__(self, seconds: float, cancel: threading.Event | None = None):
+        self.end = time.monotonic() + seconds
+        self.cancel = cancel
+
+    # This function checks whether the search should stop
+    def is_set(self) -> bool:
+        return self.expired() or (self.cancel is not None and self.cancel.is_set())
+
+    # This function checks whether the time budget has run out
+    def expired(self) -> bool:
+        return time.monotonic() >= self.end
+
+
+# This function stops the search if it has been cancelled
+def check_cancelled(cancel: threading.Event | None):
+    if cancel is not None and cancel.is_set():
+        raise SearchCancelled()
+
+
+# This function expands every deck set by the num_decks best decks that can be added to it
+# Sets that can no longer have a positive score are dropped, and so are sets that can't get every required card in the
+# num_slots slots of a full set
+def expand_war_decks(table: DeckTable, nodes, num_decks: int, cancel: threading.Event | None = None,
+                     num_slots: int = 0) -> list:
+    new_decks = []
+    expanded = 0
+    scanned = 0  # The number of decks deck_score looked at
+    for deck in nodes:
+        check_cancelled(cancel)
+        expanded += 1
+        if deck[1] & table.include_mask != table.include_mask:
+            cur_decks = islice(required_deck_score(table, deck[0], deck[1], deck[2], num_slots - len(deck[2])),
+                               num_decks)
+        else:
+            scanned += len(table.ids) - deck[3] - 1
+            cur_decks = nlargest(num_decks, deck_score(table, deck[0], deck[1], deck[2], deck[3]))
+        for cur_deck in cur_decks:
+            if float(cur_deck[0]) > 0:
+                new_decks.append(cur_deck)
+    metrics.inc("deck_score_calls_total", expanded)
+    metrics.inc("deck_score_scanned_total", scanned)
+    return new_decks
+
+
+# The deck index of a search worker process, set once when the process starts, and the id of the request its deck
+# table was last built for along with the table
+worker_index = None
+worker_request = None
+
+# The pool of search worker processes, which is kept running between requests and only started again once the deck
+# index changes, along with the deck index version and number of workers it was started for, the position of every
+# deck of the deck index, and the number of searches using each pool that is running
+search_pool = None
+search_pool_key = None
+search_pool_positions = None
+search_pool_users = {}
+search_pool_lock = threading.Lock()
+search_request_ids = count()
+
+
+# This function sets up the deck index of a search worker process
+# The decks are mapped from the deck snapshot at path, so that every worker shares its pages, and only the
+# compatibility index, which isn't in the snapshot, is sent to the worker. index is only given when there is no
+# snapshot of the version to map. If the snapshot was replaced since, the worker is left without a deck index.
+def init_search_worker(path: str, version: int, compatibility: dict | None, index: DeckIndex | None = None):
+    global worker_index
+    if index is None:
+        decks = load_deck_snapshot(version, path)
+        if decks is not None:
+            index = DeckIndex(decks, {card: idx for idx, card in enumerate(decks.card_ids)},
+                              {decks.deck_id(pos): decks.card_mask(pos) for pos in range(len(decks))}, compatibility,
+                              version)
+    worker_index = index
+
+
+# This function expands a shard of the beam in a search worker process
+# request is (request id, level vector, excluded card mask, required card mask, whether the compatibility index is
+# used, positions of the decks in the deck index). The deck table is only built for the first shard of a request.
+def expand_shard(request: tuple, nodes: list, num_decks: int, num_slots: int) -> list:
+    global worker_request
+    if worker_index is None:
+        raise snapshot.SnapshotError("The deck snapshot changed before the search worker mapped it")
+    if worker_request is None or worker_request[0] != request[0]:
+        request_id, level_of, exclude_mask, include_mask, use_compatibility, positions = request
+        table = score_deck_table(CandidateDecks(worker_index, positions), level_of, exclude_mask,
+                                 worker_index.card_index, worker_index.compatibility if use_compatibility else None,
+                                 worker_index.masks)
+        if include_mask:
+            add_required_cards(table, include_mask)
+        worker_request = (request_id, table)
+    return expand_war_decks(worker_request[1], nodes, num_decks, num_slots=num_slots)
+
+
+# This function gets the search worker pool for a deck index, starting it if there is none for the index yet
+# Workers are started with spawn, so that nothing is forked from the threads of the caller, and map the deck snapshot
+# of the index when they start. Without one, they are sent the deck index instead. Every call must be matched by a
+# call to release_search_pool.
+def get_search_pool(index: DeckIndex, workers: int) -> (ProcessPoolExecutor, dict):
+    global search_pool, search_pool_key, search_pool_positions
+    with search_pool_lock:
+        if search_pool_key != (index.version, workers):
+            old_pool = search_pool
+            initargs = (DECK_SNAPSHOT_PATH, index.version, index.compatibility)
+            deck_snapshot = index.decks if isinstance(index.decks, snapshot.DeckSnapshot) else \
+                load_deck_snapshot(index.version)
+            if deck_snapshot is None:
+                initargs += (DeckIndex(list(index.decks), index.card_index, index.masks, index.compatibility,
+                                       index.version),)
+            elif deck_snapshot is not index.decks:
+                deck_snapshot.close()
+            search_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                              initializer=init_search_worker, initargs=initargs)
+            search_pool_key = (index.version, workers)
+            search_pool_positions = index.positions
+            search_pool_users[search_pool] = 0
+            if old_pool is not None and search_pool_users[old_pool] == 0:
+                del search_pool_users[old_pool]
+                old_pool.shutdown(wait=False)
+        search_pool_users[search_pool] += 1
+        return search_pool, search_pool_positions
+
+
+# This function stops using a search worker pool, shutting it down if it was replaced and nothing else is using it
+def release_search_pool(pool: ProcessPoolExecutor):
+    with search_pool_lock:
+        search_pool_users[pool] -= 1
+        if pool is not search_pool and search_pool_users[pool] == 0:
+            del search_pool_users[pool]
+            pool.shutdown(wait=False)
+
+
+# This function finds the proven-optimal deck sets with a branch-and-bound search
+# Decks are tried in order of their standalone score, and a partial set is only extended if its upper bound, its score
+# plus the best remaining decks that share no cards with it, can beat the worst of the best sets found so far
+# The sets are kept in best, which the caller can pass in to still have the sets found so far if the search is stopped,
+# and on_improve is called every so often after better sets are found
+def exact_war_decks(table: DeckTable, decks_to_generate: int, sets_to_keep: int, include_mask: int,
+                    cancel: threading.Event | None = None, best: list | None = None, on_improve=None) -> list:
+    order = sorted((i for i in range(len(table.ids)) if table.feasible[i]), key=lambda i: -table.scores[i])
+    scores = [table.scores[i] for i in order]
+    masks = [table.masks[i] for i in order]
+    best = [] if best is None else best  # Min-heap of the best complete sets, so best[0] is the set to beat
+    improved = False
+
+    # For each required card, the last position of a deck that contains it
+    # A partial set that is still missing a required card can't be completed past that position
+    last_with_card = {}
+    for pos, mask in enumerate(masks):
+        for bit in range(include_mask.bit_length()):
+            if include_mask >> bit & mask >> bit & 1:
+                last_with_card[bit] = pos
+    if len(last_with_card) < include_mask.bit_count():
+        return best
+
+    # This function gets the upper bound of a partial set, or None if it can't be completed
+    def upper_bound(start: int, score: float, used: int, remaining: int) -> float | None:
+        for pos in range(start, len(order)):
+            if remaining == 0:
+                break
+            if not masks[pos] & used:
+                score += scores[pos]
+                remaining -= 1
+        return score if remaining == 0 else None
+
+    def search(start: int, score: float, used: int, chosen: list, remaining: int):
+        nonlocal improved
+        if remaining == 0:
+            if score > 0 and used & include_mask == include_mask:
+                node = (score, used, [table.ids[order[pos]] for pos in chosen], order[chosen[-1]])
+                if len(best) < sets_to_keep:
+                    heappush(best, node)
+                    improved = True
+                elif heappushpop(best, node) is not node:
+                    improved = True
+            return
+
+        missing = include_mask & ~used
+        end = len(order) - remaining + 1
+        if missing:
+            end = min(end, min(last_with_card[bit] for bit in range(missing.bit_length()) if missing >> bit & 1) + 1)
+
+        for pos in range(start, end):
+            # Decks are sorted by score, so if even the next best decks can't beat the threshold, no later deck can
+            threshold = best[0][0] if len(best) == sets_to_keep else 0
+            if score + sum(scores[pos:pos + remaining]) <= threshold:
+                return
+            if masks[pos] & used:
+                continue
+
+            new_used = used | masks[pos]
+            bound = upper_bound(pos + 1, score + scores[pos], new_used, remaining - 1)
+            if bound is None or bound <= threshold:
+                continue
+
+            if len(chosen) <= 1:
+                check_cancelled(cancel)
+                if improved and on_improve is not None:
+                    improved = False
+                    on_improve()
+            chosen.append(pos)
+            search(pos + 1, score + scores[pos], new_used, chosen, remaining - 1)
+            chosen.pop()
+
+    search(0, 0, 0, [], decks_to_generate)
+    return best
 
 
 # This function gets the card levels of a deck, given the deck and the level dictionary
@@ -256,73 +1376,321 @@ def get_deck_card_levels(deck: str, levels: dict) -> list:
     return ret
 
 
-# This function computes the best war decks. It changes its output based on whether it is called from the bot file or
-# the command-line file.
+# This function gets a fingerprint of a player's levels for the result cache
+def levels_fingerprint(levels: dict) -> str:
+    return hashlib.sha256(repr(sorted(levels.items(), key=lambda item: item[0])).encode()).hexdigest()
+
+
+# This function gets a result from the result cache, or None if it isn't cached
+def get_cached_result(key: tuple) -> list | None:
+    with result_cache_lock:
+        entry = result_cache.get(key)
+        if entry is None or time.monotonic() - entry[0] >= RESULT_CACHE_TTL:
+            result_cache_stats["misses"] += 1
+            metrics.inc("result_cache_total", result="miss")
+            return None
+        result_cache.move_to_end(key)
+        result_cache_stats["hits"] += 1
+        metrics.inc("result_cache_total", result="hit")
+        return entry[1]
+
+
+# This function stores a result in the result cache, evicting the least recently used result if it is full
+def cache_result(key: tuple, result: list):
+    with result_cache_lock:
+        result_cache[key] = (time.monotonic(), result)
+        result_cache.move_to_end(key)
+        while len(result_cache) > RESULT_CACHE_SIZE:
+            result_cache.popitem(last=False)
+
+
+# This function returns the share of war deck searches answered from the result cache
+def result_cache_hit_ratio() -> float:
+    with result_cache_lock:
+        total = result_cache_stats["hits"] + result_cache_stats["misses"]
+        return 0.0 if total == 0 else result_cache_stats["hits"] / total
+
+
+metrics.register_gauge("result_cache_hit_ratio", result_cache_hit_ratio)
+
+
+# This function computes the best war decks for the command line, with a progress bar
+# The bot runs search_war_decks on its job scheduler instead, see bot.py
 async def compute_war_decks(decks_to_return: int, pruning: int, variation: int, include_set: set, exclude_set: set,
-                            decks_to_generate: int, decks: list, levels: dict, message: discord.Message | None):
+                            decks_to_generate: int, decks: Sequence, levels: dict, engine: str = SEARCH_ENGINE,
+                            compatibility: dict | None = None, workers: int = SEARCH_WORKERS,
+                            decks_version: int | None = None, deadline: float | None = None, on_result=None,
+                            deck_index: DeckIndex | None = None, profile_path: str | None = None):
+    return search_war_decks(decks_to_return, pruning, variation, include_set, exclude_set, decks_to_generate, decks,
+                            levels, print, True, engine, compatibility, workers, decks_version=decks_version,
+                            deadline=deadline, on_result=on_result, profile_path=profile_path, deck_index=deck_index)
+
+
+# This function gets the file the search for a player is profiled to, in directory, or None if directory is ""
+# Every search gets its own file, so that searches for the same player don't overwrite each other
+def search_profile_path(tag: str, directory: str = SEARCH_PROFILE_DIR) -> str | None:
+    if directory == "":
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, "%s-%d.prof" % (tag.lstrip("#"), time.time_ns()))
+
+
+# This function computes the best war decks, reporting each stage of the search through the progress function
+# With progress_bar, a progress bar is also shown on the command line while each deck slot is expanded
+# The search stops with SearchCancelled as soon as it sees that the cancel event is set
+# With a deadline in seconds, the best deck sets found by then are returned. With on_result, better deck sets are
+# passed to it as they are found, starting with a quick first answer, before the final deck sets are returned.
+# When decks_version is given, results are cached until the decks table changes or RESULT_CACHE_TTL seconds pass
+# With profile_path, the search is profiled with cProfile and the stats are saved to that file
+# With deck_index, the decks must come from it, and everything it holds is used instead of being worked out again
+def search_war_decks(decks_to_return: int, pruning: int, variation: int, include_set: set, exclude_set: set,
+                     decks_to_generate: int, decks: Sequence, levels: dict, progress=print, progress_bar: bool = False,
+                     engine: str = SEARCH_ENGINE, compatibility: dict | None = None, workers: int = SEARCH_WORKERS,
+                     cancel: threading.Event | None = None, decks_version: int | None = None,
+                     deadline: float | None = None, on_result=None, profile_path: str | None = None,
+                     deck_index: DeckIndex | None = None) -> list:
+    start = time.perf_counter()
+    cached = False
+    with metrics.profile(profile_path):
+        deadline = None if deadline is None else Deadline(deadline, cancel)
+        if decks_version is None:
+            best_decks = run_war_deck_search(decks_to_return, pruning, variation, include_set, exclude_set,
+                                             decks_to_generate, decks, levels, progress, progress_bar, engine,
+                                             compatibility, workers, cancel, deadline, on_result, deck_index)
+        else:
+            key = (decks_version, levels_fingerprint(levels), frozenset(include_set), frozenset(exclude_set),
+                   decks_to_return, pruning, variation, decks_to_generate)
+            best_decks = get_cached_result(key)
+            cached = best_decks is not None
+            if best_decks is None:
+                best_decks = run_war_deck_search(decks_to_return, pruning, variation, include_set, exclude_set,
+                                                 decks_to_generate, decks, levels, progress, progress_bar, engine,
+                                                 compatibility, workers, cancel, deadline, on_result, deck_index)
+                # Deck sets from a search that ran out of time may not be the best ones, so they aren't cached
+                if deadline is None or not deadline.expired():
+                    cache_result(key, best_decks)
+            else:
+                progress("Found cached deck sets...")
+            best_decks = list(best_decks)
+
+    seconds = time.perf_counter() - start
+    metrics.observe("search_seconds", seconds, pruning=pruning, slots=decks_to_generate)
+    metrics.log_event("search", pruning=pruning, variation=variation, slots=decks_to_generate, decks=len(decks),
+                      engine=engine, cached=cached, timed_out=deadline is not None and deadline.expired(),
+                      seconds=seconds, best_score=best_decks[0][0] if best_decks else None)
+    metrics.flush()
+    return best_decks
+
+
+# This function runs the war deck search itself, see search_war_decks
+# The "numpy" engine runs the same search on a deck x card matrix, and gives the same results as the "python" engine
+def run_war_deck_search(decks_to_return: int, pruning: int, variation: int, include_set: set, exclude_set: set,
+                        decks_to_generate: int, decks: Sequence, levels: dict, progress, progress_bar: bool,
+                        engine: str, compatibility: dict | None, workers: int, cancel: threading.Event | None,
+                        deadline: Deadline | None = None, on_result=None, deck_index: DeckIndex | None = None) -> list:
+    if progress_bar:
+        from alive_progress import alive_it
+
     # Calculate the number of decks to generate in each iteration
     num_decks = 7 if pruning == 2 else 150
+    if pruning == 3 or len(include_set) > 0:
+        # The exact search doesn't use a beam, and required cards are enforced while the beam is expanded, so both
+        # always work from the deck table
+        engine = "python"
+    elif engine == "numpy" and get_vectorized() is None:
+        print("NumPy is not installed, falling back to the python search engine...")
+        engine = "python"
 
-    # Display the initial message
-    if message is None:
-        print("Getting optimal decks for deck slot 1...")
-    else:
-        message = await message.edit("Getting optimal decks for deck slot 1...")
+    # The compatibility index can only be used if it covers every deck
+    if compatibility is None or not all(deck_id in compatibility for deck_id in get_deck_ids(decks)):
+        compatibility = None
 
-    # Get the most optimal first decks
-    if decks_to_generate == 1:
-        initial_decks = nlargest(len(decks), deck_score(decks, levels, 0, set(), [], -1, exclude_set))
-    else:
-        initial_decks = nlargest(num_decks, deck_score(decks, levels, 0, set(), [], -1, exclude_set))
+    # Precompute the deck scores, with the decks and the card constraints encoded as bitmasks over a fixed card index
+    # The deck matrix of a deck index holds every deck, and the decks the player can't use are left out when scoring
+    with metrics.timer("search_stage_seconds", stage="scores"):
+        card_index = get_card_index(decks) if deck_index is None else dict(deck_index.card_index)
+        include_mask = card_mask(include_set, card_index)
+        exclude_mask = card_mask(exclude_set, card_index)
+        if engine == "numpy":
+            if deck_index is not None and deck_index.matrix is not None:
+                decks = deck_index.decks
+                matrix = deck_index.matrix
+            else:
+                matrix = vectorized.load_deck_matrix(decks, card_index)
+            scores, feasible = vectorized.score_decks(matrix, level_vector(levels, card_index), exclude_mask,
+                                                      card_index)
+        else:
+            table = build_deck_table(decks, levels, exclude_set, card_index, compatibility,
+                                     None if deck_index is None else deck_index.masks)
 
-    # Get the rest of the most optimal decks
-    for i in range(2, decks_to_generate + 1):
-        if message is None:
-            print(f"Getting optimal decks for deck slot {i}...")
+    # This function runs the beam search with num_decks sets kept per set, and returns the final beam
+    # With trim, only the num_decks best sets are kept after every deck slot. With report, every deck slot is reported
+    # through progress.
+    def beam_war_decks(num_decks: int, trim: bool, stop, executor: ProcessPoolExecutor | None, report: bool) -> list:
+        if report:
+            progress("Getting optimal decks for deck slot 1...")
+
+        # Get the most optimal first decks, which must have the hardest required card if there is one
+        first_decks = len(decks) if decks_to_generate == 1 else num_decks
+        if engine == "numpy":
+            beam = vectorized.initial_beam(matrix, scores, feasible, first_decks)
+        elif include_mask:
+            nodes = list(islice(required_deck_score(table, 0, 0, [], decks_to_generate), first_decks))
         else:
-            await message.edit(f"Getting optimal decks for deck slot {i}...")
-
-        new_decks = []
-        if message is None:
-            for deck in alive_it(initial_decks):
-                cur_decks = nlargest(num_decks, deck_score(decks, levels, deck[0], deck[1], deck[2], deck[3],
-                                                           exclude_set))
-                for cur_deck in cur_decks:
-                    if float(cur_deck[0]) > 0:
-                        new_decks.append(cur_deck)
+            nodes = nlargest(first_decks, deck_score(table, 0, 0, [], -1))
+
+        # Get the rest of the most optimal decks
+        for i in range(2, decks_to_generate + 1):
+            check_cancelled(stop)
+            if report:
+                progress(f"Getting optimal decks for deck slot {i}...")
+
+            if engine == "numpy":
+                beam = vectorized.expand_beam(matrix, scores, feasible, beam, num_decks)
+                candidates = len(beam.scores)
+                if trim and i < decks_to_generate:
+                    beam = vectorized.prune_beam(beam, num_decks)
+                if report:
+                    count_slot(i, candidates, len(beam.scores))
+                continue
+
+            if executor is not None:
+                # Shards are contiguous and merged in order, so the result is the same as expanding in this process
+                shard_size = max(1, -(-len(nodes) // (workers * 4)))
+                shards = [nodes[j:j + shard_size] for j in range(0, len(nodes), shard_size)]
+                results = executor.map(expand_shard, [request] * len(shards), shards, [num_decks] * len(shards),
+                                       [decks_to_generate] * len(shards))
+                new_decks = []
+                try:
+                    for result in alive_it(results, total=len(shards)) if progress_bar and report else results:
+                        check_cancelled(stop)
+                        new_decks.extend(result)
+                except snapshot.SnapshotError:
+                    # The workers couldn't map the deck snapshot of the index, so the beam is expanded in this process
+                    executor = None
+                    new_decks = expand_war_decks(table, nodes, num_decks, stop, decks_to_generate)
+            elif progress_bar and report:
+                new_decks = expand_war_decks(table, alive_it(nodes), num_decks, stop, decks_to_generate)
+            else:
+                new_decks = expand_war_decks(table, nodes, num_decks, stop, decks_to_generate)
+            nodes = new_decks
+            if trim and i < decks_to_generate:
+                nodes = nlargest(num_decks, nodes)
+            if report:
+                count_slot(i, len(new_decks), len(nodes))
+
+        return vectorized.beam_to_nodes(matrix, beam) if engine == "numpy" else nodes
+
+    # This function counts the deck sets generated for a deck slot, and how many of them were pruned and kept
+    def count_slot(slot: int, candidates: int, kept: int):
+        metrics.inc("search_candidates_total", candidates, slot=slot)
+        metrics.inc("search_pruned_total", candidates - kept, slot=slot)
+        metrics.inc("search_kept_total", kept, slot=slot)
+
+    # This function picks the deck sets to return from every set found so far, counting sets found twice once
+    def select_found(*found) -> list:
+        found = [nodes for nodes in found if len(nodes) > 0]
+        if len(found) <= 1:
+            return select_war_decks(found[0] if found else [], decks_to_return, variation, include_mask)
+        unique = {}
+        for nodes in found:
+            for node in nodes:
+                unique.setdefault(frozenset(node[2]), node)
+        return select_war_decks(list(unique.values()), decks_to_return, variation, include_mask)
+
+    if engine == "python" and include_mask:
+        add_required_cards(table, include_mask)
+
+    # Use the search worker pool of the deck index, sending the workers only what they need to build the deck table
+    executor = None
+    request = None
+    if engine == "python" and workers > 1 and decks_to_generate > 1 and pruning != 3 and deck_index is not None:
+        executor, index_positions = get_search_pool(deck_index, workers)
+        if isinstance(decks, CandidateDecks) and decks.index is deck_index:
+            positions = decks.positions
+        else:
+            positions = [index_positions.get(deck_id) for deck_id in get_deck_ids(decks)]
+        if None in positions:
+            # The decks aren't all in the deck index, so the beam is expanded in this process
+            release_search_pool(executor)
+            executor = None
+        else:
+            request = (next(search_request_ids), level_vector(levels, card_index), exclude_mask, include_mask,
+                       compatibility is not None, array("I", positions))
+
+    # With a deadline, the search stops when it passes and the best deck sets found so far are returned
+    stop = cancel if deadline is None else deadline
+    quick = []
+    widened = []  # The sets of the exact search before its pool was last widened
+    found = []
+    try:
+        # A narrow beam finds good deck sets quickly, so that there is an answer before the full search is done
+        if (deadline is not None or on_result is not None) and decks_to_generate > 1:
+            progress("Finding the first deck sets...")
+            with metrics.timer("search_stage_seconds", stage="quick"):
+                quick = beam_war_decks(max(ANYTIME_BEAM_WIDTH, decks_to_return), True, cancel, None, False)
+            if on_result is not None:
+                on_result(select_found(quick))
+
+        if pruning == 3:
+            # Run the exact search instead of the beam search, reporting the best sets it has found every so often
+            progress("Searching for the optimal deck sets...")
+            sets_to_keep = decks_to_return if variation == 2 else decks_to_return * EXACT_VARIATION_POOL
+            reported = time.monotonic()
+
+            def on_improve():
+                nonlocal reported
+                if on_result is not None and time.monotonic() - reported >= ANYTIME_REPORT_INTERVAL:
+                    reported = time.monotonic()
+                    on_result(select_found(quick, widened, found))
+
+            with metrics.timer("search_stage_seconds", stage="exact"):
+                exact_war_decks(table, decks_to_generate, sets_to_keep, include_mask, stop, found, on_improve)
+
+                # The varied sets are picked best first, so they are the same as with every set once the pool has
+                # enough of them. Until it does, the pool is widened, unless it already holds every set there is.
+                while variation == 1 and len(found) == sets_to_keep and \
+                        len(select_found(found)) < decks_to_return:
+                    sets_to_keep *= 2
+                    progress("Widening the search for varied deck sets...")
+                    widened, found = found, []
+                    exact_war_decks(table, decks_to_generate, sets_to_keep, include_mask, stop, found, on_improve)
         else:
-            for deck in initial_decks:
-                cur_decks = nlargest(num_decks, deck_score(decks, levels, deck[0], deck[1], deck[2], deck[3],
-                                                           exclude_set))
-                for cur_deck in cur_decks:
-                    if float(cur_deck[0]) > 0:
-                        new_decks.append(cur_deck)
-        initial_decks = new_decks
-        if pruning == 1 and i < decks_to_generate:
-            initial_decks = nlargest(num_decks, initial_decks)
+            with metrics.timer("search_stage_seconds", stage="beam"):
+                found = beam_war_decks(num_decks, pruning == 1, stop, executor, True)
+    except SearchCancelled:
+        if deadline is None or not deadline.expired():
+            raise
+        progress("Ran out of time, returning the best deck sets found so far...")
+        return select_found(quick, widened, found)
+    finally:
+        if executor is not None:
+            release_search_pool(executor)
 
     # Find the best decks
-    if message is None:
-        print("Getting best overall deck sets...")
-    else:
-        await message.edit("Getting best overall deck sets...")
+    progress("Getting best overall deck sets...")
+    with metrics.timer("search_stage_seconds", stage="select"):
+        return select_found(quick, found)
+
 
+# This function picks the deck sets to return from the final candidates
+# With variation, a set is skipped if it shares more than 23 cards with a set that was already picked
+# Only the best candidates are ordered: a partial top-k without variation, and a heap that candidates are popped off
+# best first with it. A candidate is only compared with the picked sets, of which there are at most decks_to_return,
+# so a popcount of each overlap is cheaper than keeping an index of the candidates.
+def select_war_decks(initial_decks: list, decks_to_return: int, variation: int, include_mask: int) -> list:
+    candidates = (deck_obj for deck_obj in initial_decks if deck_obj[1] & include_mask == include_mask)
+    if variation != 1:
+        return nlargest(decks_to_return, candidates, key=lambda deck_obj: float(deck_obj[0]))
+
+    # The position breaks ties so that equal scores keep their order, like a stable sort
+    heap = [(-float(deck_obj[0]), pos, deck_obj) for pos, deck_obj in enumerate(candidates)]
+    heapify(heap)
     best_decks = []
-    initial_decks = sorted(initial_decks, key=cmp_to_key(lambda deck1, deck2: float(deck2[0]) - float(deck1[0])))
-    used_cards_sets = []
-    for deck_obj in initial_decks:
-        can_add = include_set.issubset(deck_obj[1])
-        if variation == 1:
-            for used_card_set in used_cards_sets:
-                if len(deck_obj[1].intersection(used_card_set)) > 23:
-                    can_add = False
-                    break
-        if can_add:
+    while len(heap) > 0 and len(best_decks) < decks_to_return:
+        deck_obj = heappop(heap)[2]
+        if all((deck_obj[1] & picked[1]).bit_count() <= 23 for picked in best_decks):
             best_decks.append(deck_obj)
-            used_cards_sets.append(deck_obj[1])
-        if len(best_decks) == decks_to_return:
-            break
-
     return best_decks
 
 
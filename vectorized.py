@@ -0,0 +1,141 @@
+# Import Statements
+from array import array
+from dataclasses import dataclass
+import numpy as np
+import time
+
+# Number of candidate scores held in memory at once while expanding the beam
+EXPANSION_CHUNK_SIZE = 4_000_000
+
+
+# The deck list loaded into NumPy arrays
+# Row i of every array describes the deck at position i of the deck list that was passed in
+@dataclass
+class DeckMatrix:
+    ids: list  # The deck ids, which are also the comma-separated card lists
+    incidence: np.ndarray  # Deck x card matrix, 1 if the card is in the deck and 0 otherwise
+    base_score: np.ndarray  # The part of the score of each deck that is the same for every player
+    decay: np.ndarray  # The stored age decay of each deck
+    decay_until: np.ndarray  # The time the stored decay of each deck is used until, in seconds since the epoch
+    entry_time: np.ndarray  # The entry time of each deck in seconds since the epoch
+
+
+# The state of the beam search, with one row per partial deck set
+@dataclass
+class Beam:
+    scores: np.ndarray  # The score of each deck set
+    used: np.ndarray  # Deck set x card matrix of the cards used by each set
+    last: np.ndarray  # The position of the last deck added to each set
+    paths: np.ndarray  # Deck set x slot matrix of the positions of the decks in each set
+
+
+# This function loads the deck rows into a deck x card incidence matrix with stat vectors
+def load_deck_matrix(decks: list, card_index: dict) -> DeckMatrix:
+    incidence = np.zeros((len(decks), len(card_index)), dtype=np.uint8)
+    for row, deck in enumerate(decks):
+        incidence[row, [card_index[deck[i]] for i in range(1, 9)]] = 1
+    return DeckMatrix([deck[0] for deck in decks], incidence,
+                      np.fromiter((deck[13] for deck in decks), dtype=np.float64, count=len(decks)),
+                      np.fromiter((deck[14] for deck in decks), dtype=np.float64, count=len(decks)),
+                      np.fromiter((deck[15] for deck in decks), dtype=np.int64, count=len(decks)),
+                      np.fromiter((deck[12] for deck in decks), dtype=np.int64, count=len(decks)))
+
+
+# This function loads a deck snapshot into a deck matrix straight from the arrays of the mapped file
+# The base scores are worked out the same way as snapshot.DeckSnapshot rows, and the decay from the entry times
+def load_snapshot_matrix(snapshot, ids: list, num_cards: int) -> DeckMatrix:
+    cards = np.frombuffer(snapshot.cards, dtype=np.uint8).reshape(-1, 8)
+    incidence = np.zeros((len(cards), num_cards), dtype=np.uint8)
+    incidence[np.arange(len(cards))[:, None], cards] = 1
+    stats = np.frombuffer(snapshot.stats, dtype="<f4").reshape(-1, 3)
+    usage = stats[:, 1].astype(np.int64)
+    win_rate = np.round(stats[:, 2].astype(np.float64) * 10) / 10
+    return DeckMatrix(ids, incidence, 112 + usage / 2000 + win_rate / 20, np.ones(len(cards)),
+                      np.zeros(len(cards), dtype=np.int64),
+                      np.frombuffer(snapshot.entry_times, dtype="<i4").astype(np.int64))
+
+
+# This function scores every deck for a player in one matrix operation against the levels vector
+# It mirrors utilities.static_deck_score, so both engines give the same scores
+# levels is the player's level vector over the card index, with 0 for cards the player doesn't have
+def score_decks(matrix: DeckMatrix, levels: array, exclude_mask: int, card_index: dict) -> (np.ndarray, np.ndarray):
+    # Cards added to the card index after the matrix was loaded are in none of its decks, so they are left out
+    num_cards = matrix.incidence.shape[1]
+    level_of = np.frombuffer(levels, dtype=np.uint8)[:num_cards].astype(np.int32)
+    excluded = np.array([exclude_mask >> idx & 1 for idx in range(num_cards)], dtype=np.int32)
+    missing = ((level_of == 0) | (excluded == 1)).astype(np.int32)
+    levels_off_max = np.where(missing == 1, 0, 14 - level_of)
+
+    feasible = matrix.incidence @ missing == 0
+    now = int(time.time())
+    decay = np.where(now < matrix.decay_until, matrix.decay, 1 - (now - matrix.entry_time) // 86400 * 0.1)
+
+    scores = matrix.base_score - matrix.incidence @ levels_off_max
+    scores *= decay
+    scores *= 2
+    return np.where(feasible, scores, 0.0), feasible
+
+
+# This function returns the indices of the k largest values of each row, in descending order of value
+def top_k(values: np.ndarray, k: int) -> np.ndarray:
+    if k < values.shape[1]:
+        idx = np.argpartition(-values, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    order = np.argsort(-np.take_along_axis(values, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+
+# This function gets the best first decks
+def initial_beam(matrix: DeckMatrix, scores: np.ndarray, feasible: np.ndarray, num_decks: int) -> Beam:
+    candidates = np.flatnonzero(feasible)
+    order = candidates[np.argsort(-scores[candidates], kind="stable")][:num_decks]
+    return Beam(scores[order], matrix.incidence[order].astype(bool), order, order[:, None])
+
+
+# This function expands every deck set in the beam by the num_decks best decks that can be added to it
+# The disjointness of every set and deck is found with a single matrix product per chunk of the beam
+def expand_beam(matrix: DeckMatrix, scores: np.ndarray, feasible: np.ndarray, beam: Beam, num_decks: int) -> Beam:
+    num_rows = len(matrix.ids)
+    incidence_t = matrix.incidence.T.astype(np.float32)
+    positions = np.arange(num_rows)
+    chunk = max(1, EXPANSION_CHUNK_SIZE // max(1, num_rows))
+
+    if len(beam.scores) == 0:
+        return Beam(beam.scores, beam.used, beam.last, np.empty((0, beam.paths.shape[1] + 1), dtype=np.int64))
+
+    parts = []
+    for start in range(0, len(beam.scores), chunk):
+        stop = min(start + chunk, len(beam.scores))
+        conflicts = beam.used[start:stop].astype(np.float32) @ incidence_t
+        valid = (conflicts == 0) & feasible & (positions > beam.last[start:stop, None])
+        values = np.where(valid, beam.scores[start:stop, None] + scores, -np.inf)
+
+        best = top_k(values, num_decks)
+        best_values = np.take_along_axis(values, best, axis=1)
+        rows, cols = np.nonzero(best_values > 0)  # Only keep sets that could still be worth returning
+        parents = rows + start
+        decks = best[rows, cols]
+        parts.append((best_values[rows, cols], parents, decks))
+
+    new_scores = np.concatenate([part[0] for part in parts])
+    parents = np.concatenate([part[1] for part in parts])
+    decks = np.concatenate([part[2] for part in parts])
+    return Beam(new_scores, beam.used[parents] | matrix.incidence[decks].astype(bool), decks,
+                np.hstack((beam.paths[parents], decks[:, None])))
+
+
+# This function keeps only the num_decks best deck sets of the beam
+def prune_beam(beam: Beam, num_decks: int) -> Beam:
+    order = np.argsort(-beam.scores, kind="stable")[:num_decks]
+    return Beam(beam.scores[order], beam.used[order], beam.last[order], beam.paths[order])
+
+
+# This function converts the beam into the (score, used card mask, deck ids, last position) tuples used by the search
+def beam_to_nodes(matrix: DeckMatrix, beam: Beam) -> list:
+    nodes = []
+    for row in range(len(beam.scores)):
+        used = int.from_bytes(np.packbits(beam.used[row], bitorder="little").tobytes(), "little")
+        nodes.append((float(beam.scores[row]), used, [matrix.ids[idx] for idx in beam.paths[row]],
+                      int(beam.last[row])))
+    return nodes